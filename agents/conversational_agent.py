@@ -1,26 +1,30 @@
-import sqlite3
 from datetime import datetime
+from agents.migrations import migrate
+from agents.storage import get_database
 
 class ConversationalAgent:
     def __init__(self):
-        self.conn = sqlite3.connect('conversation.db', check_same_thread=False)
-        self._create_tables()
+        self.db = get_database('conversation.db')
+        self.db.write(self._create_tables)
+        migrate(self.db)
 
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS conversation_history
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              question TEXT, 
-                              answer TEXT, 
-                              timestamp DATETIME)''')
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS conversation_history
+                         (id INTEGER PRIMARY KEY, 
+                          user_id TEXT, 
+                          question TEXT, 
+                          answer TEXT, 
+                          timestamp DATETIME)''')
 
     def add_conversation(self, user_id, question, answer):
-        with self.conn:
-            self.conn.execute(
-                'INSERT INTO conversation_history (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
-                (user_id, question, answer, datetime.now())
-            )
+        self.db.insert(
+            'INSERT INTO conversation_history (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
+            [(user_id, question, answer, datetime.now())]
+        )
 
     def get_conversation_history(self, user_id, limit=5):
         return self.conn.execute(
@@ -1,57 +1,227 @@
 import requests
-import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
+from agents.news_dedup import NearDuplicateIndex, content_hash, simhash, to_signed, to_unsigned, word_set
+from agents.quote_cache import get_quote_cache
+from agents.rolling_stats import RollingStatsStore
+from agents.migrations import migrate
+from agents.storage import get_database
+from agents.tick_store import get_tick_store
+from http_client import PooledHTTPClient
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))]
 
 class DataIngestionAgent:
-    def __init__(self):
+    def __init__(self, max_workers=None, batch_size=500):
         self.api_keys = {
             'market': os.getenv('MARKET_API_KEY'),
             'news': os.getenv('NEWS_API_KEY')
         }
-        self.conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
-
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS market_data
-                             (id INTEGER PRIMARY KEY, 
-                              symbol TEXT, 
-                              price REAL, 
-                              timestamp DATETIME)''')
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS news_articles
-                             (id INTEGER PRIMARY KEY, 
-                              title TEXT, 
-                              content TEXT, 
-                              source TEXT, 
-                              timestamp DATETIME)''')
+        self.api_urls = {
+            'market': os.getenv('MARKET_API_URL', 'https://api.marketdata.com/v1'),
+            'news': os.getenv('NEWS_API_URL', 'https://api.newsdata.com/v1')
+        }
+        self.max_workers = max_workers or int(os.getenv('INGEST_MAX_WORKERS', 16))
+        self.batch_size = batch_size
+        rate_limit = os.getenv('MARKET_API_RATE_LIMIT')
+        self.http = PooledHTTPClient(
+            pool_size=self.max_workers,
+            rate_limit=float(rate_limit) if rate_limit else None
+        )
+        self.last_cycle_stats = None
+        self.validators = {}
+        self.db = get_database('market_data.db')
+        self.db.write(self._create_tables)
+        migrate(self.db)
+        self.rolling_stats = RollingStatsStore(self.db)
+        self.ticks = get_tick_store()
+        self.quotes = get_quote_cache()
+        self.near_duplicates = self._load_near_duplicate_index()
+
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS market_data
+                         (id INTEGER PRIMARY KEY, 
+                          symbol TEXT, 
+                          price REAL, 
+                          timestamp DATETIME)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS news_articles
+                         (id INTEGER PRIMARY KEY, 
+                          title TEXT, 
+                          content TEXT, 
+                          source TEXT, 
+                          timestamp DATETIME)''')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(news_articles)')}
+        for column, column_type in [('url', 'TEXT'), ('content_hash', 'TEXT'), ('simhash', 'INTEGER'), ('duplicate_of', 'INTEGER')]:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE news_articles ADD COLUMN {column} {column_type}')
+
+    def _load_near_duplicate_index(self, limit=50000):
+        index = NearDuplicateIndex(capacity=limit)
+        rows = self.conn.execute(
+            '''SELECT simhash, content_hash, title, content FROM news_articles
+               WHERE duplicate_of IS NULL AND simhash IS NOT NULL
+               ORDER BY id DESC LIMIT ?''',
+            (limit,)
+        ).fetchall()
+        for value, digest, title, content in reversed(rows):
+            index.add(to_unsigned(value), digest, word_set(f'{title} {content}'))
+        return index
+
+    def _conditional_headers(self, key):
+        validators = self.validators.get(key, {})
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def _remember_validators(self, key, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.validators[key] = {'etag': etag, 'last_modified': last_modified}
+
+    def _fetch_quote(self, symbol, conditional=False):
+        start = time.perf_counter()
+        headers = {'Authorization': f'Bearer {self.api_keys["market"]}'}
+        if conditional:
+            headers.update(self._conditional_headers(('quote', symbol)))
+        price, status = None, None
+        try:
+            response = self.http.get(f'{self.api_urls["market"]}/quotes/{symbol}', headers=headers)
+            status = response.status_code
+            if status == 200:
+                price = response.json()['price']
+                self._remember_validators(('quote', symbol), response)
+        except (requests.RequestException, ValueError, KeyError):
+            price = None
+        return symbol, price, datetime.utcnow(), time.perf_counter() - start, status
+
+    def _insert_ticks(self, conn, ticks):
+        conn.executemany(
+            'INSERT INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)',
+            ticks
+        )
+        self.ticks.append(ticks)
+        self.rolling_stats.update(ticks)
+
+    def _write_ticks(self, ticks):
+        if ticks:
+            self.db.write(self._insert_ticks, ticks)
+            self.quotes.update(ticks)
 
     def fetch_market_data(self, symbols):
-        for symbol in symbols:
-            response = requests.get(
-                f'https://api.marketdata.com/v1/quotes/{symbol}',
-                headers={'Authorization': f'Bearer {self.api_keys["market"]}'} 
-            )
-            if response.status_code == 200:
-                data = response.json()
-                self.conn.execute(
-                    'INSERT INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)',
-                    (symbol, data['price'], datetime.now())
-                )
-        self.conn.commit()
+        """
+        Fetch quotes concurrently over the pooled session and insert them in batches,
+        one transaction per batch. Returns (and keeps in last_cycle_stats) the cycle's
+        throughput and latency figures.
+        """
+        start = time.perf_counter()
+        latencies = []
+        pending = []
+        succeeded = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._fetch_quote, symbol) for symbol in symbols]
+            for future in as_completed(futures):
+                symbol, price, timestamp, latency, _ = future.result()
+                latencies.append(latency)
+                if price is None:
+                    continue
+                pending.append((symbol, price, timestamp))
+                succeeded += 1
+                if len(pending) >= self.batch_size:
+                    self._write_ticks(pending)
+                    pending = []
+        self._write_ticks(pending)
 
-    def fetch_news(self, topics):
-        response = requests.get(
-            'https://api.newsdata.com/v1/news',
-            params={'api-key': self.api_keys['news'], 'q': ','.join(topics)}
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        self.last_cycle_stats = {
+            'requested': len(futures),
+            'succeeded': succeeded,
+            'failed': len(futures) - succeeded,
+            'elapsed_seconds': elapsed,
+            'symbols_per_second': len(futures) / elapsed if elapsed > 0 else 0,
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p95': _percentile(latencies, 95),
+            'latency_max': latencies[-1] if latencies else None
+        }
+        return self.last_cycle_stats
+
+    def _fetch_articles(self, topics, conditional=False):
+        """Returns (article rows ready for _write_articles, HTTP status)"""
+        key = ('news', ','.join(topics))
+        response = self.http.get(
+            f'{self.api_urls["news"]}/news',
+            params={'api-key': self.api_keys['news'], 'q': ','.join(topics)},
+            headers=self._conditional_headers(key) if conditional else None
         )
-        if response.status_code == 200:
-            for article in response.json()['results']:
-                self.conn.execute(
-                    'INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)',
-                    (article['title'], article['content'], article['source'], datetime.now())
-                )
-            self.conn.commit()
+        if response.status_code != 200:
+            return [], response.status_code
+        self._remember_validators(key, response)
+        now = datetime.now()
+        rows = [
+            (article['title'], article['content'], article['source'], article.get('link') or article.get('url'), now)
+            for article in response.json()['results']
+        ]
+        return rows, response.status_code
+
+    def _write_articles(self, rows):
+        return self.db.write(self._insert_articles, rows)
+
+    def _insert_articles(self, conn, rows):
+        """
+        Insert (title, content, source, url, timestamp) rows, dropping exact repeats
+        (content hash / URL) and flagging near-duplicates (NearDuplicateIndex) via duplicate_of
+        so downstream sentiment work only sees new stories. Returns the number of
+        new original articles.
+        """
+        originals, copies, seen = [], [], set()
+        for title, content, source, url, timestamp in rows:
+            digest = content_hash(title, content)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            fingerprint = simhash(f'{title} {content}')
+            words = word_set(f'{title} {content}')
+            match = self.near_duplicates.find(fingerprint, words)
+            row = (title, content, source, url, digest, to_signed(fingerprint), timestamp)
+            if match is None or match == digest:
+                originals.append(row)
+                self.near_duplicates.add(fingerprint, digest, words)
+            else:
+                copies.append((row, match))
+        if not originals and not copies:
+            return 0
+
+        insert = '''INSERT OR IGNORE INTO news_articles
+                      (title, content, source, url, content_hash, simhash, duplicate_of, timestamp)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+        before = conn.total_changes
+        conn.executemany(insert, [row[:6] + (None,) + row[6:] for row in originals])
+        inserted = conn.total_changes - before
+        if copies:
+            matches = list({match for _, match in copies})
+            ids = dict(conn.execute(
+                f"SELECT content_hash, id FROM news_articles WHERE content_hash IN ({','.join('?' * len(matches))})",
+                matches
+            ))
+            conn.executemany(insert, [row[:6] + (ids.get(match),) + row[6:] for row, match in copies])
+        return inserted
+
+    def fetch_news(self, topics):
+        rows, _ = self._fetch_articles(topics)
+        return self._write_articles(rows)
 
     def get_latest_data(self, table, limit=10):
         return self.conn.execute(f'SELECT * FROM {table} ORDER BY timestamp DESC LIMIT ?', (limit,)).fetchall()
@@ -0,0 +1,117 @@
+import queue
+import sqlite3
+import threading
+import time
+
+_bus = None
+_bus_lock = threading.Lock()
+
+class Subscription:
+    """One consumer's bounded queue of (topic, data) events; the oldest are dropped when it falls behind"""
+    def __init__(self, bus, topics=None, user_id=None, symbols=None, maxsize=1000):
+        self.bus = bus
+        self.topics = set(topics) if topics else None
+        self.user_id = str(user_id) if user_id is not None else None
+        self.symbols = set(symbols) if symbols else None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def matches(self, topic, user_id, symbol):
+        if self.topics is not None and topic not in self.topics:
+            return False
+        if user_id is not None and str(user_id) != self.user_id:
+            return False
+        if symbol is not None and self.symbols is not None and symbol not in self.symbols:
+            return False
+        return True
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next (topic, data) event, or None after timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class EventBus:
+    """
+    In-process fan-out of quote, recommendation and risk events. Producers publish
+    once; every matching subscription gets the event on its own queue, so the cost
+    of a new dashboard is one queue rather than another polling loop.
+    """
+    def __init__(self):
+        self.subscriptions = []
+        self._lock = threading.Lock()
+        self._watchers = {}
+
+    def subscribe(self, topics=None, user_id=None, symbols=None, maxsize=1000):
+        subscription = Subscription(self, topics, user_id, symbols, maxsize)
+        with self._lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def publish(self, topic, data, user_id=None, symbol=None):
+        """Deliver data to subscriptions for topic; user_id/symbol restrict it to matching ones"""
+        with self._lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(topic, user_id, symbol):
+                subscription.put((topic, data))
+
+    def watch_table(self, db, table, topic, interval=1.0):
+        """
+        Publish rows inserted into table by other processes (e.g. the agents) as topic
+        events, addressed to each row's user_id. One polling thread per table per process.
+        """
+        key = (db.path, table)
+        with self._lock:
+            if key in self._watchers:
+                return
+            self._watchers[key] = thread = threading.Thread(
+                target=self._watch_table, args=(db, table, topic, interval), name=f'event-watch:{table}', daemon=True
+            )
+        thread.start()
+
+    def _watch_table(self, db, table, topic, interval):
+        last_id = None
+        while True:
+            try:
+                conn = db.connection()
+                if last_id is None:
+                    last_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+                cursor = conn.execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id', (last_id,))
+                columns = [c[0] for c in cursor.description]
+                for row in cursor.fetchall():
+                    data = dict(zip(columns, row))
+                    last_id = data['id']
+                    self.publish(topic, data, user_id=data.get('user_id'))
+            except sqlite3.OperationalError:
+                pass  # table not created yet
+            time.sleep(interval)
+
+def get_event_bus():
+    """The process-wide EventBus"""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus()
+        return _bus
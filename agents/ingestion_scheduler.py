@@ -0,0 +1,227 @@
+import heapq
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+NEWS_KEY = '__news__'
+
+class IngestionScheduler:
+    """
+    Long-running poller for quotes and news built on DataIngestionAgent.
+
+    Every symbol (and the news topic set) has its own polling interval. Requests are
+    conditional (ETag / If-Modified-Since), so a symbol that has not changed upstream
+    costs a 304 and no write. Fetched rows go through a bounded queue to a single
+    writer thread; once the queue passes its high-water mark, polling pauses until
+    the writer catches up. Failed writes are retried with backoff up to
+    max_write_backoff seconds apart; rows still unwritten at stop() are dropped.
+    """
+    def __init__(self, agent, symbols, quote_interval=5.0, symbol_intervals=None,
+                 news_topics=None, news_interval=300.0, max_queue=1000,
+                 high_water=0.8, write_batch=500, max_write_backoff=5.0):
+        self.agent = agent
+        self.intervals = {symbol: quote_interval for symbol in symbols}
+        self.intervals.update(symbol_intervals or {})
+        self.news_topics = news_topics
+        self.news_interval = news_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.high_water = max(1, int(max_queue * high_water))
+        self.write_batch = write_batch
+        self.max_write_backoff = max_write_backoff
+
+        self._heap = []
+        self._in_flight = set()
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._executor = None
+        self._last_success = {}
+        self._stats = {
+            'polls': 0,
+            'not_modified': 0,
+            'errors': 0,
+            'ticks_written': 0,
+            'articles_written': 0,
+            'write_errors': 0,
+            'last_write_error': None,
+            'write_retry_rows': 0,
+            'rows_dropped': 0,
+            'backpressure_waits': 0,
+            'last_write_lag': None,
+            'max_write_lag': 0.0
+        }
+
+    def start(self):
+        now = time.monotonic()
+        with self._lock:
+            self._heap = [(now, symbol) for symbol in self.intervals]
+            if self.news_topics:
+                self._heap.append((now, NEWS_KEY))
+            heapq.heapify(self._heap)
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.agent.max_workers)
+        self._threads = [
+            threading.Thread(target=self._schedule_loop, name='ingestion-scheduler', daemon=True),
+            threading.Thread(target=self._write_loop, name='ingestion-writer', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        self._threads[0].join(timeout)
+        self._executor.shutdown(wait=True)
+        # The writer drains whatever is still queued before exiting
+        self._threads[1].join(timeout)
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def metrics(self):
+        """
+        Counters, queue state and seconds since each symbol (and NEWS_KEY) last polled
+        successfully: None for a key that never has, which makes max_staleness inf
+        """
+        now = time.monotonic()
+        keys = list(self.intervals) + ([NEWS_KEY] if self.news_topics else [])
+        with self._lock:
+            staleness = {
+                key: now - self._last_success[key] if key in self._last_success else None
+                for key in keys
+            }
+            return dict(
+                self._stats,
+                queue_depth=self.queue.qsize(),
+                queue_capacity=self.queue.maxsize,
+                in_flight=len(self._in_flight),
+                staleness=staleness,
+                never_succeeded=sum(age is None for age in staleness.values()),
+                max_staleness=max((float('inf') if age is None else age for age in staleness.values()),
+                                  default=0.0)
+            )
+
+    def _interval(self, key):
+        return self.news_interval if key == NEWS_KEY else self.intervals[key]
+
+    def _schedule_loop(self):
+        while not self._stop.is_set():
+            if self.queue.qsize() >= self.high_water:
+                with self._lock:
+                    self._stats['backpressure_waits'] += 1
+                self._stop.wait(0.05)
+                continue
+
+            with self._lock:
+                now = time.monotonic()
+                if not self._heap or self._heap[0][0] > now:
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._lock.wait(timeout)
+                    continue
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+                self._in_flight.update(due)
+
+            for key in due:
+                self._executor.submit(self._poll, key)
+
+    def _poll(self, key):
+        status = None
+        try:
+            if key == NEWS_KEY:
+                rows, status = self.agent._fetch_articles(self.news_topics, conditional=True)
+                if rows:
+                    self.queue.put(('articles', rows, time.monotonic()))
+            else:
+                symbol, price, timestamp, _, status = self.agent._fetch_quote(key, conditional=True)
+                if price is not None:
+                    self.queue.put(('ticks', [(symbol, price, timestamp)], time.monotonic()))
+        except Exception:
+            status = None
+        finally:
+            with self._lock:
+                self._stats['polls'] += 1
+                if status == 304:
+                    self._stats['not_modified'] += 1
+                elif status != 200:
+                    self._stats['errors'] += 1
+                if status in (200, 304):
+                    self._last_success[key] = time.monotonic()
+                self._in_flight.discard(key)
+                heapq.heappush(self._heap, (time.monotonic() + self._interval(key), key))
+                self._lock.notify_all()
+
+    def _write_loop(self):
+        # Items whose write failed are retried (with backoff) before anything new is
+        # taken from the queue, so a failing database backs the queue up into
+        # backpressure instead of losing rows; metrics() reports the errors.
+        retry = []
+        backoff = 0.0
+        while True:
+            if retry:
+                if self._stop.is_set() and backoff >= self.max_write_backoff:
+                    self._drop(retry)
+                    retry = []
+                    continue
+                self._stop.wait(backoff)
+                items, retry = retry, []
+            else:
+                if self._stop.is_set() and self.queue.empty() and not self._executor_busy():
+                    return
+                try:
+                    items = [self.queue.get(timeout=0.1)]
+                except queue.Empty:
+                    continue
+                size = len(items[0][1])
+                while size < self.write_batch:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    items.append(item)
+                    size += len(item[1])
+                for _ in items:
+                    self.queue.task_done()
+
+            for kind, write in (('ticks', self.agent._write_ticks), ('articles', self.agent._write_articles)):
+                batch = [item for item in items if item[0] == kind]
+                if not batch:
+                    continue
+                try:
+                    written = write([row for _, rows, _ in batch for row in rows])
+                except Exception as e:
+                    retry.extend(batch)
+                    with self._lock:
+                        self._stats['write_errors'] += 1
+                        self._stats['last_write_error'] = repr(e)
+                    continue
+                lag = time.monotonic() - min(enqueued for _, _, enqueued in batch)
+                with self._lock:
+                    if kind == 'ticks':
+                        self._stats['ticks_written'] += sum(len(rows) for _, rows, _ in batch)
+                    else:
+                        self._stats['articles_written'] += written
+                    self._stats['last_write_lag'] = lag
+                    self._stats['max_write_lag'] = max(self._stats['max_write_lag'], lag)
+            with self._lock:
+                self._stats['write_retry_rows'] = sum(len(rows) for _, rows, _ in retry)
+            backoff = min(max(2 * backoff, 0.1), self.max_write_backoff) if retry else 0.0
+
+    def _drop(self, items):
+        with self._lock:
+            self._stats['rows_dropped'] += sum(len(rows) for _, rows, _ in items)
+            self._stats['write_retry_rows'] = 0
+
+    def _executor_busy(self):
+        with self._lock:
+            return bool(self._in_flight)
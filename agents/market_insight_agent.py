@@ -1,26 +1,86 @@
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from textblob import TextBlob
+from agents.sentiment_cache import SentimentCache, text_hash
+from agents.migrations import migrate
+from agents.storage import MAX_SQL_PARAMS, get_database
+from agents.symbol_matcher import SymbolMatcher
+
+def _polarity(text):
+    # Module level so it can run in ProcessPoolExecutor workers
+    return TextBlob(text).sentiment.polarity
+
+def _sentiment_label(polarity):
+    if polarity > 0.1:
+        return 'positive'
+    elif polarity < -0.1:
+        return 'negative'
+    else:
+        return 'neutral'
 
 class MarketInsightAgent:
-    def __init__(self):
-        self.conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
-
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS sentiment_reports
-                             (id INTEGER PRIMARY KEY, 
-                              article_id INTEGER, 
-                              summary TEXT, 
-                              sentiment_polarity REAL, 
-                              sentiment_label TEXT, 
-                              timestamp DATETIME,
-                             FOREIGN KEY(article_id) REFERENCES news_articles(id))''')
+    def __init__(self, max_workers=None, parallel_threshold=200, symbol_aliases=None, half_life_hours=24):
+        self.db = get_database('market_data.db')
+        self.db.write(self._create_tables)
+        migrate(self.db)
+        self.sentiment_cache = SentimentCache(self.db)
+        self.symbol_matcher = SymbolMatcher(self._load_symbols(), symbol_aliases)
+        self.half_life_hours = half_life_hours
+        self.max_workers = max_workers
+        self.parallel_threshold = parallel_threshold
+        self.last_batch_stats = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS sentiment_reports
+                         (id INTEGER PRIMARY KEY, 
+                          article_id INTEGER, 
+                          summary TEXT, 
+                          sentiment_polarity REAL, 
+                          sentiment_label TEXT, 
+                          timestamp DATETIME,
+                         FOREIGN KEY(article_id) REFERENCES news_articles(id))''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS processing_state
+                         (name TEXT PRIMARY KEY, 
+                          last_id INTEGER, 
+                          timestamp DATETIME)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS article_symbols
+                         (article_id INTEGER, 
+                          symbol TEXT, 
+                          PRIMARY KEY (article_id, symbol))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_article_symbols_symbol ON article_symbols(symbol)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS symbol_sentiment
+                         (symbol TEXT PRIMARY KEY, 
+                          decayed_polarity REAL, 
+                          decayed_weight REAL, 
+                          sentiment REAL, 
+                          article_count INTEGER, 
+                          last_article_id INTEGER, 
+                          last_summary TEXT, 
+                          timestamp DATETIME)''')
+
+    def _load_symbols(self):
+        try:
+            return [row[0] for row in self.conn.execute('SELECT DISTINCT symbol FROM market_data') if row[0]]
+        except sqlite3.OperationalError:
+            # market_data is created by DataIngestionAgent; nothing ingested yet
+            return []
+
+    def refresh_symbols(self):
+        self.symbol_matcher.symbols.update(symbol.upper() for symbol in self._load_symbols())
 
     def _get_recent_articles(self, limit=5):
         return self.conn.execute(
-            'SELECT * FROM news_articles ORDER BY timestamp DESC LIMIT ?', 
+            'SELECT * FROM news_articles WHERE duplicate_of IS NULL ORDER BY timestamp DESC LIMIT ?', 
             (limit,)
         ).fetchall()
 
@@ -30,38 +90,229 @@ class MarketInsightAgent:
             return content
         return content[:max_length].rsplit(' ', 1)[0] + '...'
 
+    def _get_executor(self):
+        # One pool for the agent's lifetime: worker start-up (and TextBlob import) is paid once
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers or os.cpu_count() or 1)
+            return self._executor
+
+    def close(self):
+        """Shut down the sentiment process pool, if one was started"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
     def analyze_sentiment(self, text):
-        analysis = TextBlob(text)
-        polarity = analysis.sentiment.polarity
-        if polarity > 0.1:
-            return 'positive', polarity
-        elif polarity < -0.1:
-            return 'negative', polarity
-        else:
-            return 'neutral', polarity
+        return self.analyze_sentiment_batch([text])[0]
 
-    def generate_insight_report(self):
-        articles = self._get_recent_articles()
-        reports = []
-        
-        for article in articles:
-            summary = self._generate_summary(article[2])  # content field
-            sentiment_label, polarity = self.analyze_sentiment(summary)
-            
-            self.conn.execute(
-                'INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp) VALUES (?, ?, ?, ?, ?)',
-                (article[0], summary, polarity, sentiment_label, datetime.now())
+    def analyze_sentiment_batch(self, texts):
+        """
+        Score many texts at once. Identical texts are scored once, cached polarities
+        (in-memory LRU, then the sentiment_cache table) are reused, and large batches
+        of misses are spread over a process pool. Throughput lands in last_batch_stats.
+        """
+        start = time.perf_counter()
+        keys = [text_hash(text) for text in texts]
+        unique = dict(zip(keys, texts))
+        polarities = self.sentiment_cache.get_many(list(unique))
+        misses = [key for key in unique if key not in polarities]
+
+        if misses:
+            miss_texts = [unique[key] for key in misses]
+            if len(misses) >= self.parallel_threshold:
+                workers = self.max_workers or os.cpu_count() or 1
+                executor = self._get_executor()
+                scored = list(executor.map(_polarity, miss_texts, chunksize=max(1, len(misses) // (4 * workers))))
+            else:
+                scored = [_polarity(text) for text in miss_texts]
+            polarities.update(zip(misses, scored))
+            self.sentiment_cache.put_many(zip(misses, scored))
+
+        elapsed = time.perf_counter() - start
+        self.last_batch_stats = {
+            'texts': len(texts),
+            'unique_texts': len(unique),
+            'cache_hits': len(unique) - len(misses),
+            'scored': len(misses),
+            'elapsed_seconds': elapsed,
+            'texts_per_second': len(texts) / elapsed if elapsed > 0 else 0
+        }
+        return [(_sentiment_label(polarities[key]), polarities[key]) for key in keys]
+
+    def _score_articles(self, articles):
+        """(id, title, content, timestamp) rows -> report dicts for each article"""
+        summaries = [self._generate_summary(content) for _, _, content, _ in articles]
+        sentiments = self.analyze_sentiment_batch(summaries)
+        return [{
+            'article_id': article_id,
+            'title': title,
+            'summary': summary,
+            'sentiment': sentiment_label,
+            'polarity': polarity,
+            'symbols': self.symbol_matcher.find(f'{title} {content}'),
+            'published_at': datetime.fromisoformat(str(timestamp)) if timestamp else None
+        } for (article_id, title, content, timestamp), summary, (sentiment_label, polarity)
+            in zip(articles, summaries, sentiments)]
+
+    def _save_reports(self, reports, last_id=None):
+        """Upsert reports (one per article) and optionally advance the high-water mark in the same transaction"""
+        self.db.write(self._store_reports, reports, last_id, datetime.now())
+
+    def _store_reports(self, conn, reports, last_id, now):
+        conn.executemany(
+            '''INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(article_id) DO UPDATE SET summary = excluded.summary,
+                   sentiment_polarity = excluded.sentiment_polarity,
+                   sentiment_label = excluded.sentiment_label, timestamp = excluded.timestamp''',
+            [(r['article_id'], r['summary'], r['polarity'], r['sentiment'], now) for r in reports]
+        )
+        self._update_symbol_sentiment(conn, reports, now)
+        if last_id is not None:
+            conn.execute(
+                '''INSERT INTO processing_state (name, last_id, timestamp) VALUES ('sentiment', ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET last_id = MAX(last_id, excluded.last_id), timestamp = excluded.timestamp''',
+                (last_id, now)
             )
-            reports.append({
-                'title': article[1],
-                'summary': summary,
-                'sentiment': sentiment_label,
-                'polarity': round(polarity, 3)
-            })
-        
-        self.conn.commit()
+
+    def _update_symbol_sentiment(self, conn, reports, now):
+        """
+        Fold newly tagged articles into each symbol's exponentially time-decayed sentiment.
+        Decay runs on article time, not processing time, so a backfill weights the archive
+        by age: a symbol's sums are anchored at its newest article (its timestamp), and an
+        older article is added already decayed to that anchor.
+        """
+        tagged = [r for r in reports if r.get('symbols')]
+        if not tagged:
+            return
+        ids = [r['article_id'] for r in tagged]
+        seen = set()
+        for start in range(0, len(ids), MAX_SQL_PARAMS):
+            chunk = ids[start:start + MAX_SQL_PARAMS]
+            seen.update(row[0] for row in conn.execute(
+                f"SELECT DISTINCT article_id FROM article_symbols WHERE article_id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        tagged = [r for r in tagged if r['article_id'] not in seen]
+        if not tagged:
+            return
+        conn.executemany(
+            'INSERT OR IGNORE INTO article_symbols (article_id, symbol) VALUES (?, ?)',
+            [(r['article_id'], symbol) for r in tagged for symbol in r['symbols']]
+        )
+
+        symbols = sorted({symbol for r in tagged for symbol in r['symbols']})
+        state = {}
+        for start in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[start:start + MAX_SQL_PARAMS]
+            state.update((row[0], list(row[1:])) for row in conn.execute(
+                f'''SELECT symbol, decayed_polarity, decayed_weight, article_count, last_article_id, last_summary, timestamp
+                    FROM symbol_sentiment WHERE symbol IN ({','.join('?' * len(chunk))})''', chunk
+            ))
+        def decay(newer, older):
+            return 0.5 ** (max((newer - older).total_seconds(), 0) / 3600 / self.half_life_hours)
+
+        for r in tagged:
+            published = r.get('published_at') or now
+            for symbol in r['symbols']:
+                polarity, weight, count, last_id, last_summary, anchor = state.get(symbol, [0.0, 0.0, 0, None, None, None])
+                anchor = datetime.fromisoformat(str(anchor)) if anchor is not None else None
+                if anchor is None or published >= anchor:
+                    factor = decay(published, anchor) if anchor is not None else 1.0
+                    state[symbol] = [polarity * factor + r['polarity'], weight * factor + 1, count + 1,
+                                     r['article_id'], r['summary'], published]
+                else:
+                    factor = decay(anchor, published)
+                    state[symbol] = [polarity + r['polarity'] * factor, weight + factor, count + 1,
+                                     last_id, last_summary, anchor]
+        conn.executemany(
+            '''INSERT OR REPLACE INTO symbol_sentiment
+               (symbol, decayed_polarity, decayed_weight, sentiment, article_count, last_article_id, last_summary, timestamp)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            [(symbol, p, w, p / w if w else 0.0, c, a, summary, t)
+             for symbol, (p, w, c, a, summary, t) in state.items() if symbol in symbols]
+        )
+
+    def get_symbol_sentiment(self, symbols=None):
+        """Decayed mean polarity per symbol, as (symbol, sentiment, article_count, last_summary, timestamp) rows"""
+        query = 'SELECT symbol, sentiment, article_count, last_summary, timestamp FROM symbol_sentiment'
+        if symbols is None:
+            return self.conn.execute(query + ' ORDER BY symbol').fetchall()
+        symbols = list(symbols)
+        if not symbols:
+            return []
+        rows = []
+        for start in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[start:start + MAX_SQL_PARAMS]
+            rows.extend(self.conn.execute(query + f" WHERE symbol IN ({','.join('?' * len(chunk))})", chunk))
+        return sorted(rows)
+
+    def get_high_water_mark(self):
+        row = self.conn.execute("SELECT last_id FROM processing_state WHERE name = 'sentiment'").fetchone()
+        return row[0] if row else 0
+
+    def _get_articles_after(self, last_id, limit):
+        return self.conn.execute(
+            '''SELECT id, title, content, timestamp FROM news_articles
+               WHERE id > ? AND duplicate_of IS NULL ORDER BY id LIMIT ?''',
+            (last_id, limit)
+        ).fetchall()
+
+    def process_new_articles(self, batch_size=100, max_batches=None):
+        """Score only articles past the high-water mark, batch by batch. Returns the new reports."""
+        # Pick up symbols ingested since the matcher was built
+        self.refresh_symbols()
+        reports = []
+        last_id = self.get_high_water_mark()
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            articles = self._get_articles_after(last_id, batch_size)
+            if not articles:
+                break
+            batch = self._score_articles(articles)
+            last_id = articles[-1][0]
+            self._save_reports(batch, last_id)
+            reports.extend(batch)
+            batches += 1
         return reports
 
+    def backfill(self, chunk_size=1000, progress=None):
+        """
+        Score the whole archive in id order, chunk by chunk. Upserts make it safe to
+        re-run or interrupt; progress(processed, total) is called after every chunk.
+        """
+        self.refresh_symbols()
+        total = self.conn.execute('SELECT COUNT(*) FROM news_articles WHERE duplicate_of IS NULL').fetchone()[0]
+        processed = 0
+        last_id = 0
+        while True:
+            articles = self._get_articles_after(last_id, chunk_size)
+            if not articles:
+                break
+            last_id = articles[-1][0]
+            self._save_reports(self._score_articles(articles), last_id)
+            processed += len(articles)
+            if progress:
+                progress(processed, total)
+        return processed
+
+    def generate_insight_report(self, incremental=False):
+        if incremental:
+            reports = self.process_new_articles()
+        else:
+            self.refresh_symbols()
+            articles = self._get_recent_articles()
+            reports = self._score_articles([(article[0], article[1], article[2], article[4]) for article in articles])
+            self._save_reports(reports)
+
+        return [{
+            'title': r['title'],
+            'summary': r['summary'],
+            'sentiment': r['sentiment'],
+            'polarity': round(r['polarity'], 3)
+        } for r in reports]
+
     def get_latest_reports(self, limit=5):
         return self.conn.execute(
             'SELECT * FROM sentiment_reports ORDER BY timestamp DESC LIMIT ?', 
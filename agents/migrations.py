@@ -0,0 +1,96 @@
+import os
+from datetime import datetime
+
+from agents.news_dedup import content_hash, simhash, to_signed
+
+def _backfill_article_hashes(conn):
+    # Articles stored before dedup existed: hash them, and point repeats at the first copy
+    rows = conn.execute(
+        'SELECT id, title, content FROM news_articles WHERE content_hash IS NULL AND duplicate_of IS NULL ORDER BY id'
+    ).fetchall()
+    if not rows:
+        return
+    first_ids = dict(conn.execute('SELECT content_hash, id FROM news_articles WHERE content_hash IS NOT NULL'))
+    updates, duplicates = [], []
+    for article_id, title, content in rows:
+        digest = content_hash(title, content)
+        if digest in first_ids:
+            duplicates.append((first_ids[digest], article_id))
+        else:
+            first_ids[digest] = article_id
+            updates.append((digest, to_signed(simhash(f'{title} {content}')), article_id))
+    conn.executemany('UPDATE news_articles SET content_hash = ?, simhash = ? WHERE id = ?', updates)
+    conn.executemany('UPDATE news_articles SET duplicate_of = ? WHERE id = ?', duplicates)
+
+# Ordered, append-only migrations per database file: (name, table or table.column it
+# needs, steps). A step is SQL or a callable(conn). A migration is applied once, as
+# soon as what it depends on exists.
+MIGRATIONS = {
+    'market_data.db': [
+        ('0001_market_data_symbol_timestamp', 'market_data', [
+            'CREATE INDEX IF NOT EXISTS idx_market_data_symbol_timestamp ON market_data(symbol, timestamp)'
+        ]),
+        ('0002_news_articles_duplicate_timestamp', 'news_articles.duplicate_of', [
+            'CREATE INDEX IF NOT EXISTS idx_news_articles_duplicate_timestamp ON news_articles(duplicate_of, timestamp)'
+        ]),
+        ('0003_sentiment_reports_timestamp', 'sentiment_reports', [
+            'CREATE INDEX IF NOT EXISTS idx_sentiment_reports_timestamp ON sentiment_reports(timestamp)'
+        ]),
+        ('0004_recommendations_user_timestamp', 'recommendations', [
+            'CREATE INDEX IF NOT EXISTS idx_recommendations_user_timestamp ON recommendations(user_id, timestamp)'
+        ]),
+        ('0005_news_articles_content_hash', 'news_articles.content_hash', [
+            _backfill_article_hashes,
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_news_articles_content_hash ON news_articles(content_hash)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_news_articles_url ON news_articles(url) WHERE url IS NOT NULL'
+        ]),
+        # Older runs inserted a report per call; keep the newest per article so reports can be upserted
+        ('0006_sentiment_reports_one_per_article', 'sentiment_reports', [
+            '''DELETE FROM sentiment_reports WHERE id NOT IN
+               (SELECT MAX(id) FROM sentiment_reports GROUP BY article_id)''',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_sentiment_reports_article ON sentiment_reports(article_id)'
+        ])
+    ],
+    'portfolio.db': [
+        ('0001_portfolio_user_timestamp', 'portfolio', [
+            'CREATE INDEX IF NOT EXISTS idx_portfolio_user_timestamp ON portfolio(user_id, timestamp)'
+        ]),
+        ('0002_risk_metrics_user_timestamp', 'risk_metrics', [
+            'CREATE INDEX IF NOT EXISTS idx_risk_metrics_user_timestamp ON risk_metrics(user_id, timestamp)'
+        ])
+    ],
+    'conversation.db': [
+        ('0001_conversation_history_user_timestamp', 'conversation_history', [
+            'CREATE INDEX IF NOT EXISTS idx_conversation_history_user_timestamp ON conversation_history(user_id, timestamp)'
+        ])
+    ]
+}
+
+def _apply(conn, migrations):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_migrations
+                 (name TEXT PRIMARY KEY,
+                  applied_at DATETIME)''')
+    applied = {row[0] for row in conn.execute('SELECT name FROM schema_migrations')}
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    done = []
+    for name, needs, steps in migrations:
+        table, _, column = needs.partition('.')
+        if name in applied or table not in tables:
+            continue
+        if column and column not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute('INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)', (name, datetime.now()))
+        done.append(name)
+    return done
+
+def migrate(db):
+    """Apply pending migrations for db's file through its writer; returns the names applied"""
+    migrations = MIGRATIONS.get(os.path.basename(db.path), [])
+    if not migrations:
+        return []
+    return db.write(_apply, migrations)
@@ -0,0 +1,122 @@
+import hashlib
+import re
+from collections import Counter, deque
+import numpy as np
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+_BIT_POSITIONS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+SHORT_TEXT_WORDS = 60  # texts up to this many distinct words are also compared by Jaccard
+MIN_JACCARD = 0.8
+MAX_POSTING = 1000  # words in more short articles than this are not used to find candidates
+MAX_JACCARD_CANDIDATES = 20
+
+def normalize_text(text):
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+def word_set(text):
+    """Distinct normalized words of text, for NearDuplicateIndex's Jaccard comparison"""
+    return frozenset(normalize_text(text).split())
+
+def content_hash(title, content):
+    normalized = normalize_text(title) + '\n' + normalize_text(content)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def simhash(text, shingle_size=3):
+    """64-bit SimHash over word shingles; close texts give hashes a few bits apart"""
+    words = normalize_text(text).split()
+    if not words:
+        return 0
+    shingles = {' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles],
+        dtype=np.uint64
+    )
+    bits = (hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(hashes)
+    return int(sum(1 << i for i in np.flatnonzero(votes > 0)))
+
+def to_signed(value):
+    # SQLite INTEGER is signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+class NearDuplicateIndex:
+    """
+    Banded SimHash index. With max_distance < SIMHASH_BANDS, two hashes within
+    max_distance bits must agree on at least one band, so lookups only compare
+    against articles sharing a band instead of the whole archive.
+
+    A one-word edit moves a short text's SimHash by several bits (each word sits in
+    up to three shingles), so texts of at most SHORT_TEXT_WORDS words are first
+    compared by word-set Jaccard similarity against short articles sharing words.
+    """
+    def __init__(self, max_distance=3, capacity=50000, min_jaccard=MIN_JACCARD):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.min_jaccard = min_jaccard
+        self.bands = [{} for _ in range(SIMHASH_BANDS)]
+        self.postings = {}  # word -> keys of short articles containing it
+        self.word_sets = {}  # key -> word set, short articles only
+        self.order = deque()
+
+    def _band_keys(self, value):
+        mask = (1 << BAND_BITS) - 1
+        return [(value >> (i * BAND_BITS)) & mask for i in range(SIMHASH_BANDS)]
+
+    def _find_similar_words(self, words):
+        # Count shared words per candidate, skipping words too common to narrow anything down
+        shared = Counter()
+        for word in words:
+            keys = self.postings.get(word)
+            if keys and len(keys) <= MAX_POSTING:
+                shared.update(keys)
+        for article_key, _ in shared.most_common(MAX_JACCARD_CANDIDATES):
+            other = self.word_sets[article_key]
+            if len(words & other) / len(words | other) >= self.min_jaccard:
+                return article_key
+        return None
+
+    def find(self, value, words=None):
+        """
+        Key of an indexed article whose word set (for short texts, see word_set) is
+        at least min_jaccard similar, or whose SimHash is within max_distance bits of
+        value; None if there is none
+        """
+        if words and len(words) <= SHORT_TEXT_WORDS:
+            article_key = self._find_similar_words(words)
+            if article_key is not None:
+                return article_key
+        for band, key in zip(self.bands, self._band_keys(value)):
+            for other, article_key in band.get(key, ()):
+                if bin(value ^ other).count('1') <= self.max_distance:
+                    return article_key
+        return None
+
+    def add(self, value, article_key, words=None):
+        for band, key in zip(self.bands, self._band_keys(value)):
+            band.setdefault(key, []).append((value, article_key))
+        if words and len(words) <= SHORT_TEXT_WORDS and article_key not in self.word_sets:
+            self.word_sets[article_key] = frozenset(words)
+            for word in words:
+                self.postings.setdefault(word, set()).add(article_key)
+        self.order.append((value, article_key))
+        if len(self.order) > self.capacity:
+            self._evict(*self.order.popleft())
+
+    def _evict(self, value, article_key):
+        for band, key in zip(self.bands, self._band_keys(value)):
+            entries = band.get(key, [])
+            if (value, article_key) in entries:
+                entries.remove((value, article_key))
+            if not entries:
+                band.pop(key, None)
+        for word in self.word_sets.pop(article_key, ()):
+            keys = self.postings.get(word)
+            if keys is not None:
+                keys.discard(article_key)
+                if not keys:
+                    del self.postings[word]
@@ -1,23 +1,28 @@
 import requests
-import sqlite3
 from datetime import datetime
 import os
+from agents.migrations import migrate
+from agents.storage import get_database
 
 class PortfolioTracker:
     def __init__(self):
         self.api_key = os.getenv('BROKERAGE_API_KEY')
-        self.conn = sqlite3.connect('portfolio.db', check_same_thread=False)
-        self._create_tables()
+        self.db = get_database('portfolio.db')
+        self.db.write(self._create_tables)
+        migrate(self.db)
 
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS portfolio
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              symbol TEXT, 
-                              quantity REAL, 
-                              purchase_price REAL, 
-                              timestamp DATETIME)''')
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS portfolio
+                         (id INTEGER PRIMARY KEY, 
+                          user_id TEXT, 
+                          symbol TEXT, 
+                          quantity REAL, 
+                          purchase_price REAL, 
+                          timestamp DATETIME)''')
 
     def fetch_portfolio_data(self, user_id):
         response = requests.get(
@@ -27,12 +32,11 @@ class PortfolioTracker:
         )
         if response.status_code == 200:
             positions = response.json()['positions']
-            with self.conn:
-                for position in positions:
-                    self.conn.execute(
-                        'INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)',
-                        (user_id, position['symbol'], position['quantity'], position['price'], datetime.now())
-                    )
+            now = datetime.now()
+            self.db.insert(
+                'INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)',
+                [(user_id, position['symbol'], position['quantity'], position['price'], now) for position in positions]
+            )
             return positions
         return None
 
@@ -0,0 +1,221 @@
+import fcntl
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from agents.tick_store import get_tick_store
+
+SLOT_DTYPE = np.dtype([
+    ('symbol', 'S32'),
+    ('price', '<f8'),
+    ('timestamp', 'datetime64[us]'),
+    ('updated', '<f8'),  # wall-clock seconds when the quote was written
+    ('version', '<i8')   # odd while a writer is mid-update
+])
+# Lock-free reads give up after this many torn reads (e.g. a writer died mid-update)
+READ_RETRIES = 1000
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+class QuoteCache:
+    """
+    Latest quote per symbol, held in memory so current prices never need a disk read.
+
+    With a path the quotes live in a memory-mapped file (e.g. under /dev/shm) that
+    every process opening the same path shares, such as gunicorn workers: writers
+    take an flock, readers go lock-free and retry on a per-slot version change.
+
+    Subscribers are called as callback(symbol, quote, previous) when a symbol's price
+    changes. Local writes notify immediately; in shared mode a watcher thread also
+    notifies of writes made by other processes.
+
+    Quotes older than ttl seconds are stale: get() flags them and get_prices() treats
+    them as missing, so callers fall back to the tick store.
+    """
+    def __init__(self, ttl=60, path=None, capacity=65536, poll_interval=0.1):
+        self.ttl = ttl
+        self.path = path
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.subscribers = []
+        self._lock = threading.RLock()
+        self._quotes = {}
+        self._slots = {}
+        self._watcher = None
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        size = self.capacity * SLOT_DTYPE.itemsize
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+        self._lock_file = open(path, 'rb')
+        self._table = np.memmap(path, dtype=SLOT_DTYPE, mode='r+', shape=(self.capacity,))
+        self._seen = self._table['version'].copy()
+
+    def _slot(self, symbol, create=False):
+        """Index of symbol's slot in the shared table (linear probing), or None"""
+        slot = self._slots.get(symbol)
+        if slot is not None:
+            return slot
+        key = symbol.encode('utf-8')[:SLOT_DTYPE['symbol'].itemsize]
+        start = zlib.crc32(key) % self.capacity
+        for i in range(self.capacity):
+            slot = (start + i) % self.capacity
+            current = self._table['symbol'][slot]
+            if current == key:
+                self._slots[symbol] = slot
+                return slot
+            if not current:
+                if not create:
+                    return None
+                self._table['symbol'][slot] = key
+                self._slots[symbol] = slot
+                return slot
+        raise RuntimeError(f"Quote cache is full ({self.capacity} symbols)")
+
+    def _read_slot(self, slot):
+        table = self._table
+        for _ in range(READ_RETRIES):
+            before = table['version'][slot]
+            if before % 2 == 0:
+                price, timestamp, updated = table['price'][slot], table['timestamp'][slot], table['updated'][slot]
+                if table['version'][slot] == before:
+                    return (float(price), timestamp.item(), float(updated)) if before else None
+        return None
+
+    def _write_slots(self, quotes):
+        table = self._table
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            for symbol, (price, timestamp, updated) in quotes.items():
+                slot = self._slot(symbol, create=True)
+                # An odd version under the flock was left by a writer that died mid-update
+                table['version'][slot] += 1 + table['version'][slot] % 2
+                table['price'][slot] = price
+                table['timestamp'][slot] = np.datetime64(timestamp, 'us')
+                table['updated'][slot] = updated
+                table['version'][slot] += 1
+                self._seen[slot] = table['version'][slot]
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _lookup(self, symbol):
+        if self.path:
+            slot = self._slot(symbol)
+            return self._read_slot(slot) if slot is not None else None
+        return self._quotes.get(symbol)
+
+    def _as_dict(self, symbol, quote):
+        price, timestamp, updated = quote
+        age = time.time() - updated
+        return {'symbol': symbol, 'price': price, 'timestamp': timestamp, 'age': age, 'stale': age > self.ttl}
+
+    def update(self, ticks):
+        """Record an iterable of (symbol, price, timestamp) ticks; returns the symbols whose price changed"""
+        now = time.time()
+        latest = {}
+        for symbol, price, timestamp in ticks:
+            timestamp = np.datetime64(timestamp, 'us').item() if timestamp is not None else datetime.utcnow()
+            latest[symbol] = (float(price), timestamp, now)
+        changes = []
+        with self._lock:
+            for symbol, quote in latest.items():
+                previous = self._lookup(symbol)
+                if previous is None or previous[0] != quote[0]:
+                    changes.append((symbol, quote, previous))
+            if self.path:
+                self._write_slots(latest)
+            else:
+                self._quotes.update(latest)
+        self._notify(changes)
+        return [symbol for symbol, _, _ in changes]
+
+    def get(self, symbol):
+        """{'symbol', 'price', 'timestamp', 'age', 'stale'} for symbol, or None"""
+        quote = self._lookup(symbol)
+        return self._as_dict(symbol, quote) if quote else None
+
+    def get_prices(self, symbols, max_age=None):
+        """Array of cached prices, NaN where a symbol is missing or older than max_age seconds (default ttl)"""
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        prices = np.full(len(symbols), np.nan)
+        for i, symbol in enumerate(symbols):
+            quote = self._lookup(symbol)
+            if quote and now - quote[2] <= max_age:
+                prices[i] = quote[0]
+        return prices
+
+    def subscribe(self, callback):
+        with self._lock:
+            self.subscribers.append(callback)
+            if self.path and self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='quote-cache-watcher', daemon=True)
+                self._watcher.start()
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self.subscribers.remove(callback)
+
+    def _notify(self, changes):
+        for symbol, quote, previous in changes:
+            quote = self._as_dict(symbol, quote)
+            previous = self._as_dict(symbol, previous) if previous else None
+            for callback in list(self.subscribers):
+                callback(symbol, quote, previous)
+
+    def _watch(self):
+        # Picks up writes from other processes by diffing slot versions
+        previous = {}
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                versions = self._table['version'].copy()
+                changed = np.flatnonzero((versions != self._seen) & (versions % 2 == 0))
+                self._seen[changed] = versions[changed]
+            changes = []
+            for slot in changed:
+                symbol = self._table['symbol'][slot].decode('utf-8')
+                quote = self._read_slot(slot)
+                if quote and (symbol not in previous or previous[symbol][0] != quote[0]):
+                    changes.append((symbol, quote, previous.get(symbol)))
+                previous[symbol] = quote
+            self._notify(changes)
+
+def get_quote_cache():
+    """
+    Shared QuoteCache for the process: in memory, or in the memory-mapped file at
+    QUOTE_CACHE_PATH when set so every worker sees the same quotes
+    """
+    path = os.getenv('QUOTE_CACHE_PATH') or None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = QuoteCache(ttl=float(os.getenv('QUOTE_CACHE_TTL', 60)), path=path)
+        return cache
+
+def latest_prices(symbols, max_age=None):
+    """
+    Current price of each symbol from the quote cache (quotes up to max_age seconds
+    old, default the cache ttl), falling back to the tick store (NaN if unknown)
+    """
+    prices = get_quote_cache().get_prices(symbols, max_age)
+    store = get_tick_store()
+    for i in np.flatnonzero(np.isnan(prices)):
+        latest = store.latest(symbols[i])
+        if latest:
+            prices[i] = latest[1]
+    return prices
@@ -1,65 +1,104 @@
-import sqlite3
 from datetime import datetime
 import pandas as pd
+from agents.migrations import migrate
+from agents.storage import MAX_SQL_PARAMS, get_database, unified_connection, unified_enabled
 
 class RecommendationAgent:
     def __init__(self):
-        self.portfolio_conn = sqlite3.connect('portfolio.db', check_same_thread=False)
-        self.market_conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
-
-    def _create_tables(self):
-        with self.market_conn:
-            self.market_conn.execute('''CREATE TABLE IF NOT EXISTS recommendations
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              recommendation TEXT, 
-                              confidence REAL, 
-                              timestamp DATETIME)''')
+        self.portfolio_db = get_database('portfolio.db')
+        self.market_db = get_database('market_data.db')
+        self.market_db.write(self._create_tables)
+        migrate(self.market_db)
+        migrate(self.portfolio_db)
+
+    @property
+    def portfolio_conn(self):
+        return self.portfolio_db.connection()
+
+    @property
+    def market_conn(self):
+        return self.market_db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS recommendations
+                         (id INTEGER PRIMARY KEY, 
+                          user_id TEXT, 
+                          recommendation TEXT, 
+                          confidence REAL, 
+                          timestamp DATETIME)''')
 
     def _get_portfolio_risk(self, user_id):
-        risk_conn = sqlite3.connect('portfolio.db')
-        risk_metrics = pd.read_sql(f"SELECT * FROM risk_metrics WHERE user_id = '{user_id}' ORDER BY timestamp DESC LIMIT 1", risk_conn)
+        risk_metrics = pd.read_sql(
+            "SELECT * FROM risk_metrics WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1",
+            self.portfolio_conn, params=(str(user_id),)
+        )
         return risk_metrics.iloc[0] if not risk_metrics.empty else None
 
-    def _get_sentiment_data(self):
-        return pd.read_sql("SELECT * FROM sentiment_reports ORDER BY timestamp DESC LIMIT 5", self.market_conn)
+    def _get_latest_risk(self):
+        return pd.read_sql(
+            '''SELECT user_id, var_percentage FROM (
+                   SELECT user_id, var_percentage,
+                          ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC) AS rn
+                   FROM risk_metrics)
+               WHERE rn = 1''',
+            self.portfolio_conn
+        )
+
+    def _get_held_sentiment(self, user_id=None):
+        """(user_id, symbol, sentiment, last_summary) for held symbols that have aggregated sentiment"""
+        where, params = ('WHERE p.user_id = ?', (user_id,)) if user_id is not None else ('', ())
+        if unified_enabled():
+            return pd.read_sql(
+                f'''SELECT DISTINCT p.user_id, p.symbol, s.sentiment, s.last_summary
+                    FROM portfolio.portfolio p JOIN market.symbol_sentiment s ON s.symbol = p.symbol
+                    {where} ORDER BY p.user_id, p.symbol''',
+                unified_connection(), params=params
+            )
+        holdings = pd.read_sql(
+            f'SELECT DISTINCT user_id, symbol FROM portfolio p {where}', self.portfolio_conn, params=params
+        )
+        symbols = list(holdings['symbol'].unique())
+        if not symbols:
+            return holdings.assign(sentiment=pd.Series(dtype=float), last_summary=pd.Series(dtype=object))
+        sentiment = pd.concat([
+            pd.read_sql(
+                f"SELECT symbol, sentiment, last_summary FROM symbol_sentiment WHERE symbol IN ({','.join('?' * len(chunk))})",
+                self.market_conn, params=chunk
+            )
+            for chunk in (symbols[i:i + MAX_SQL_PARAMS] for i in range(0, len(symbols), MAX_SQL_PARAMS))
+        ], ignore_index=True)
+        return holdings.merge(sentiment, on='symbol').sort_values(['user_id', 'symbol'])
+
+    def _get_top_sentiment(self, limit=2):
+        return pd.read_sql(
+            "SELECT symbol, sentiment, last_summary FROM symbol_sentiment WHERE sentiment > 0.1 ORDER BY sentiment DESC, timestamp DESC LIMIT ?",
+            self.market_conn, params=(limit,)
+        )
 
     def generate_recommendations(self, user_id):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
         risk_metrics = self._get_portfolio_risk(user_id)
-        sentiment_data = self._get_sentiment_data()
+        held_sentiment = self._get_held_sentiment(user_id)
         
         recommendations = []
         
         # Risk-based recommendations
-        if risk_metrics and risk_metrics['var_percentage'] > 5:
+        if risk_metrics is not None and risk_metrics['var_percentage'] > 5:
             recommendations.append({
                 'type': 'risk',
                 'message': f'High portfolio risk ({risk_metrics["var_percentage"]:.1f}% VaR). Consider diversifying high-risk positions.',
                 'confidence': 0.8
             })
         
-        # Sentiment-based recommendations
-        negative_assets = []
-        positive_opportunities = []
-        
-        for _, row in sentiment_data.iterrows():
-            if row['sentiment_label'] == 'negative':
-                # Check if user holds this asset
-                matching = portfolio[portfolio['symbol'] == row['title'].split()[0]]
-                if not matching.empty:
-                    negative_assets.append({
-                        'symbol': row['title'].split()[0],
-                        'reason': row['summary'],
-                        'confidence': 0.7
-                    })
-            elif row['sentiment_label'] == 'positive' and len(positive_opportunities) < 2:
-                positive_opportunities.append({
-                    'symbol': row['title'].split()[0],
-                    'reason': row['summary'],
-                    'confidence': 0.65
-                })
+        # Sentiment-based recommendations from the per-symbol aggregates
+        negative = held_sentiment[held_sentiment['sentiment'] < -0.1]
+        negative_assets = [
+            {'symbol': row.symbol, 'reason': row.last_summary, 'confidence': 0.7}
+            for row in negative.itertuples()
+        ]
+        positive_opportunities = [
+            {'symbol': row.symbol, 'reason': row.last_summary, 'confidence': 0.65}
+            for row in self._get_top_sentiment(2).itertuples()
+        ]
         
         # Add negative asset recommendations
         for asset in negative_assets:
@@ -78,15 +117,71 @@ class RecommendationAgent:
             })
         
         # Store recommendations
-        with self.market_conn:
-            for rec in recommendations:
-                self.market_conn.execute(
-                    'INSERT INTO recommendations (user_id, recommendation, confidence, timestamp) VALUES (?, ?, ?, ?)',
-                    (user_id, rec['message'], rec['confidence'], datetime.now())
-                )
+        now = datetime.now()
+        self.market_db.insert(
+            'INSERT INTO recommendations (user_id, recommendation, confidence, timestamp) VALUES (?, ?, ?, ?)',
+            [(user_id, rec['message'], rec['confidence'], now) for rec in recommendations]
+        )
         
         return recommendations
 
+    def generate_all_recommendations(self, user_ids=None):
+        """
+        Nightly recommendations for every user with a portfolio (or just user_ids).
+        Users, held-symbol sentiment and each user's latest risk row are read with one
+        query each, combined in pandas, and written with a single executemany. Produces
+        the same messages as generate_recommendations; returns them as a DataFrame.
+        """
+        holders = pd.read_sql('SELECT DISTINCT user_id FROM portfolio', self.portfolio_conn)['user_id']
+        risk = self._get_latest_risk()
+        held_sentiment = self._get_held_sentiment()
+        if user_ids is not None:
+            user_ids = [str(user_id) for user_id in user_ids]
+            holders = holders[holders.isin(user_ids)]
+            risk = risk[risk['user_id'].isin(user_ids)]
+            held_sentiment = held_sentiment[held_sentiment['user_id'].isin(user_ids)]
+        users = pd.Series(pd.unique(pd.concat([holders, risk['user_id']])), name='user_id')
+
+        high_risk = risk[risk['var_percentage'] > 5]
+        risk_recs = pd.DataFrame({
+            'user_id': high_risk['user_id'],
+            'kind': 0,
+            'recommendation': 'High portfolio risk (' + high_risk['var_percentage'].map('{:.1f}'.format).astype(str)
+                              + '% VaR). Consider diversifying high-risk positions.',
+            'confidence': 0.8
+        })
+
+        negative = held_sentiment[held_sentiment['sentiment'] < -0.1]
+        negative_recs = pd.DataFrame({
+            'user_id': negative['user_id'],
+            'kind': 1,
+            'recommendation': 'Consider reviewing position in ' + negative['symbol'].astype(str)
+                              + ' due to negative sentiment: ' + negative['last_summary'].fillna('').astype(str),
+            'confidence': 0.7
+        })
+
+        top = self._get_top_sentiment(2)
+        opportunities = users.to_frame().merge(top, how='cross')
+        opportunity_recs = pd.DataFrame({
+            'user_id': opportunities['user_id'],
+            'kind': 2,
+            'recommendation': 'Positive sentiment detected for ' + opportunities['symbol'].astype(str) + ': '
+                              + opportunities['last_summary'].fillna('').astype(str) + ' - may warrant consideration',
+            'confidence': 0.65
+        })
+
+        recommendations = pd.concat([risk_recs, negative_recs, opportunity_recs], ignore_index=True)
+        recommendations = recommendations.sort_values(['user_id', 'kind'], kind='stable').drop(columns='kind')
+        now = datetime.now()
+
+        self.market_db.insert(
+            'INSERT INTO recommendations (user_id, recommendation, confidence, timestamp) VALUES (?, ?, ?, ?)',
+            [(user_id, text, float(confidence), now) for user_id, text, confidence
+             in recommendations[['user_id', 'recommendation', 'confidence']].itertuples(index=False, name=None)]
+        )
+        recommendations['timestamp'] = now
+        return recommendations.reset_index(drop=True)
+
     def get_user_recommendations(self, user_id, limit=5):
         return self.market_conn.execute(
             'SELECT * FROM recommendations WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?', 
@@ -1,78 +1,471 @@
+import os
 import sqlite3
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from statistics import NormalDist
 from sklearn.linear_model import LinearRegression
 import numpy as np
+from agents.migrations import migrate
+from agents.quote_cache import get_quote_cache
+from agents.rolling_stats import create_symbol_stats
+from agents.storage import MAX_SQL_PARAMS, get_database
+from agents.tick_store import TICK_DTYPE, get_tick_store
+
+VAR_METHODS = ('historical', 'parametric', 'monte_carlo')
+# Fewest returns every position must share before portfolio VaR uses their joint history
+MIN_COMMON_WINDOW = 20
+
+def _common_window(returns):
+    """
+    The trailing columns where every position has a return (rows are right-aligned),
+    or None when they are fewer than MIN_COMMON_WINDOW (or the whole history, if
+    shorter) and too few to estimate co-movement from
+    """
+    common = returns[:, ~np.isnan(returns).any(axis=0)]
+    required = max(2, min(MIN_COMMON_WINDOW, returns.shape[1]))
+    return common if common.shape[1] >= required else None
+
+def _returns_from_prices(prices):
+    # Simple returns along the time axis; NaN wherever either price is missing
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return prices[:, 1:] / prices[:, :-1] - 1
+
+def _value_at_risk(returns, values, confidence_level=0.95, method='historical', simulations=10000, seed=None,
+                   volatility=None):
+    """
+    Per-position and portfolio VaR for a positions x periods return matrix
+    Returns (position_var, undiversified_var, portfolio_var, common_window), losses
+    as positive numbers. Portfolio VaR is the undiversified VaR when the positions'
+    common window is too short (see _common_window); common_window is its length.
+    For the parametric and Monte Carlo methods, volatility (per position, NaN where
+    unknown) replaces the sample volatility; correlations still come from returns.
+    """
+    if method not in VAR_METHODS:
+        raise ValueError(f"Unknown VaR method: {method}")
+    q = 100 * (1 - confidence_level)
+    n = len(values)
+    if n == 0:
+        return np.zeros(0), 0.0, 0.0, 0
+
+    common = _common_window(returns)
+    window = common.shape[1] if common is not None else 0
+
+    if method == 'historical':
+        position_pnl = values * np.nanpercentile(returns, q, axis=1)
+        undiversified = abs(position_pnl.sum())
+        portfolio = abs(np.percentile(values @ common, q)) if common is not None else undiversified
+        return np.abs(position_pnl), undiversified, portfolio, window
+
+    z = NormalDist().inv_cdf(1 - confidence_level)
+    mu = np.nanmean(returns, axis=1)
+    sigma = np.nanstd(returns, axis=1, ddof=1) if returns.shape[1] > 1 else np.zeros(n)
+    sigma = np.nan_to_num(sigma)
+    if common is not None:
+        cov = np.atleast_2d(np.cov(common))
+    else:
+        cov = np.diag(sigma ** 2)
+    if volatility is not None:
+        sample = np.sqrt(np.diag(cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.nan_to_num(cov / np.outer(sample, sample))
+        np.fill_diagonal(corr, 1.0)
+        sigma = np.where(np.isnan(volatility), sigma, volatility)
+        cov = corr * np.outer(sigma, sigma)
+
+    if method == 'parametric':
+        position_var = np.abs(values * (mu + z * sigma))
+        if common is None:
+            return position_var, position_var.sum(), position_var.sum(), window
+        portfolio = abs(values @ mu + z * np.sqrt(max(values @ cov @ values, 0.0)))
+        return position_var, position_var.sum(), portfolio, window
+
+    rng = np.random.default_rng(seed)
+    simulated = rng.multivariate_normal(mu, cov, size=simulations, method='eigh')
+    position_var = np.abs(np.percentile(simulated * values, q, axis=0))
+    portfolio = abs(np.percentile(simulated @ values, q)) if common is not None else position_var.sum()
+    return position_var, position_var.sum(), portfolio, window
+
+def _aggregate_user_risk(task):
+    # Runs in a worker process: combine precomputed per-symbol stats into one user's metrics
+    user_id, position_count, quantities, last_prices, percentiles, returns, confidence_level = task
+    values = quantities * last_prices
+    valid = ~np.isnan(percentiles) & ~np.isnan(values)
+    values, returns = values[valid], returns[valid]
+    var = abs((values * percentiles[valid]).sum())
+    common = _common_window(returns) if len(values) else None
+    portfolio_var = abs(np.percentile(values @ common, 100 * (1 - confidence_level))) if common is not None else var
+    total_value = values.sum()
+    return {
+        'user_id': user_id,
+        'timestamp': datetime.now(),
+        'total_portfolio_value': total_value,
+        'value_at_risk_95': var,
+        'var_percentage': (var/total_value)*100 if total_value > 0 else 0,
+        'portfolio_var': portfolio_var,
+        'common_window': common.shape[1] if common is not None else 0,
+        'position_count': position_count
+    }
 
 class RiskAnalyzer:
     def __init__(self):
-        self.market_conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self.portfolio_conn = sqlite3.connect('portfolio.db', check_same_thread=False)
+        self.market_db = get_database('market_data.db')
+        self.portfolio_db = get_database('portfolio.db')
+        self.ticks = get_tick_store()
+        self.quotes = get_quote_cache()
+        self.portfolio_db.write(self._create_tables)
+        self.market_db.write(create_symbol_stats)
+        migrate(self.market_db)
+        migrate(self.portfolio_db)
+
+    @property
+    def market_conn(self):
+        return self.market_db.connection()
+
+    @property
+    def portfolio_conn(self):
+        return self.portfolio_db.connection()
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS risk_metrics
+                         (id INTEGER PRIMARY KEY, 
+                          user_id TEXT, 
+                          total_portfolio_value REAL, 
+                          value_at_risk_95 REAL, 
+                          var_percentage REAL, 
+                          portfolio_var REAL, 
+                          position_count INTEGER, 
+                          timestamp DATETIME)''')
+
+    def _read_market_data(self, symbols, sql, params=()):
+        """
+        Rows of sql run over symbols in MAX_SQL_PARAMS chunks; sql has a {symbols}
+        placeholder for the IN list, followed by params. Empty before market_data exists.
+        """
+        symbols = list(symbols)
+        chunks = []
+        for offset in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[offset:offset + MAX_SQL_PARAMS]
+            try:
+                chunks.append(pd.read_sql(sql.format(symbols=','.join('?' * len(chunk))), self.market_conn,
+                                          params=(*chunk, *params)))
+            except (sqlite3.OperationalError, pd.errors.DatabaseError):
+                return pd.DataFrame()  # market_data not created yet
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def _last_ticks_many(self, symbols, n):
+        """
+        The most recent n ticks of each symbol, oldest first. Symbols the tick store
+        holds fewer for (history written before the store existed and not yet copied
+        over by backfill_ticks.py) are filled from market_data with one windowed query.
+        """
+        ticks = [self.ticks.last(symbol, n) for symbol in symbols]
+        short = [symbol for symbol, t in zip(symbols, ticks) if len(t) < n]
+        if not short:
+            return ticks
+        rows = self._read_market_data(short, '''SELECT symbol, timestamp, price FROM (
+                                                   SELECT symbol, timestamp, price,
+                                                          ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) AS rn
+                                                   FROM market_data WHERE symbol IN ({symbols}))
+                                               WHERE rn <= ? ORDER BY symbol, timestamp''', (n,))
+        if rows.empty:
+            return ticks
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+        for symbol, group in rows.groupby('symbol', sort=False):
+            i = index[symbol]
+            if len(group) > len(ticks[i]):
+                fill = np.zeros(len(group), dtype=TICK_DTYPE)
+                fill['timestamp'] = pd.to_datetime(group['timestamp']).to_numpy(dtype='datetime64[us]')
+                fill['price'] = group['price'].to_numpy(dtype=float)
+                ticks[i] = fill
+        return ticks
+
+    def _last_ticks(self, symbol, n):
+        return self._last_ticks_many([symbol], n)[0]
 
     def _get_historical_prices(self, symbol, days=30):
-        query = '''SELECT timestamp, price 
-                   FROM market_data 
-                   WHERE symbol = ? 
-                   ORDER BY timestamp DESC 
-                   LIMIT ?'''
-        df = pd.read_sql(query, self.market_conn, params=(symbol, days))
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.sort_values('timestamp')
-        return df
+        ticks = self._last_ticks(symbol, days)
+        return pd.DataFrame({'timestamp': ticks['timestamp'], 'price': ticks['price']})
+
+    def get_volatility(self, symbols):
+        """Precomputed rolling/EWMA volatility maintained by DataIngestionAgent, indexed by symbol"""
+        symbols = list(symbols)
+        columns = ['symbol', 'last_price', 'return_count', 'mean_return', 'volatility', 'ewma_volatility', 'timestamp']
+        chunks = [
+            pd.read_sql(
+                f"SELECT {', '.join(columns)} FROM symbol_stats WHERE symbol IN ({','.join('?' * len(chunk))})",
+                self.market_conn, params=chunk
+            )
+            for chunk in (symbols[i:i + MAX_SQL_PARAMS] for i in range(0, len(symbols), MAX_SQL_PARAMS))
+        ]
+        stats = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+        return stats.set_index('symbol')
+
+    def _get_holdings(self, user_id):
+        """A user's positions with each symbol's latest price (NaN when there is none)"""
+        holdings = self._get_portfolio(user_id)[['symbol', 'quantity']]
+        symbols = list(dict.fromkeys(holdings['symbol']))
+        latest = dict(zip(symbols, self._get_latest_prices(symbols)))
+        return holdings.assign(price=holdings['symbol'].map(latest).astype(float))
+
+    def _get_portfolio(self, user_id):
+        return pd.read_sql('SELECT * FROM portfolio WHERE user_id = ?', self.portfolio_conn, params=(user_id,))
+
+    def _get_price_matrix(self, symbols, days=30):
+        """
+        Last `days` prices of every symbol, read as slices of the tick store's
+        partitions (or market_data, see _last_ticks_many). Returns a len(symbols) x days array, oldest first,
+        right-aligned and NaN-padded for symbols with shorter histories.
+        """
+        prices = np.full((len(symbols), days), np.nan)
+        for i, ticks in enumerate(self._last_ticks_many(symbols, days)):
+            if len(ticks):
+                prices[i, days - len(ticks):] = ticks['price']
+        return prices
+
+    def calculate_var(self, user_id, confidence_level=0.95, days=30, method='historical', simulations=10000, seed=None):
+        """
+        Vectorized VaR for a user's portfolio using one price query for all positions.
+        method is 'historical', 'parametric' or 'monte_carlo'; portfolio_var accounts
+        for correlation between positions, var is the sum of position VaRs. The
+        parametric and Monte Carlo methods use each symbol's EWMA volatility from
+        symbol_stats where ingestion has recorded one.
+        """
+        portfolio = self._get_portfolio(user_id)
+        symbols = list(dict.fromkeys(portfolio['symbol']))
+        prices = self._get_price_matrix(symbols, days)
+        returns = _returns_from_prices(prices)
+
+        rows = portfolio['symbol'].map({symbol: i for i, symbol in enumerate(symbols)}).to_numpy(dtype=int)
+        valid = (~np.isnan(returns[rows])).any(axis=1)
+        rows = rows[valid]
+        values = portfolio['quantity'].to_numpy(dtype=float)[valid] * prices[rows, -1]
+
+        volatility = None
+        if method != 'historical':
+            stored = self.get_volatility(symbols)['ewma_volatility'].astype(float)
+            volatility = stored.reindex(symbols).to_numpy()[rows]
+        position_var, var, portfolio_var, window = _value_at_risk(
+            returns[rows], values, confidence_level, method, simulations, seed, volatility
+        )
+        positions = [
+            {'symbol': symbols[row], 'position_value': value, 'value_at_risk': pvar}
+            for row, value, pvar in zip(rows, values, position_var)
+        ]
+        return {
+            'method': method,
+            'position_count': len(portfolio),
+            'confidence_level': confidence_level,
+            'total_value': values.sum(),
+            'var': var,
+            'portfolio_var': portfolio_var,
+            'diversification_benefit': var - portfolio_var,
+            'common_window': window,
+            'positions': positions
+        }
 
     def calculate_value_at_risk(self, user_id, confidence_level=0.95, days=30):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
-        total_value = 0
-        var_total = 0
-        
-        for _, row in portfolio.iterrows():
-            symbol = row['symbol']
-            quantity = row['quantity']
-            price_data = self._get_historical_prices(symbol, days)
-            
-            if len(price_data) < 2:
-                continue
-                
-            returns = price_data['price'].pct_change().dropna()
-            if len(returns) == 0:
-                continue
-                
-            var = np.percentile(returns, 100 * (1 - confidence_level))
-            position_value = quantity * price_data['price'].iloc[-1]
-            var_total += position_value * var
-            total_value += position_value
-            
-        return abs(var_total), total_value
+        result = self.calculate_var(user_id, confidence_level, days, method='historical')
+        return result['var'], result['total_value']
+
+    def _get_latest_prices(self, symbols, max_age=None):
+        """
+        Current prices from the quote cache (quotes up to max_age seconds old, default
+        the cache ttl), reading the tick store only for symbols it lacks
+        """
+        prices = self.quotes.get_prices(symbols, max_age)
+        missing = np.flatnonzero(np.isnan(prices))
+        if len(missing):
+            prices[missing] = self._get_price_matrix([symbols[i] for i in missing], days=1)[:, 0]
+        return prices
+
+    def _get_replay_returns(self, symbols, start, end):
+        """
+        Each symbol's return from its first price at/after start to its last price at/before end.
+        Symbols with no ticks in the store for the range are read from market_data in one query.
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        returns = np.zeros(len(symbols))
+        missing = {}
+        for i, symbol in enumerate(symbols):
+            # The store's ranges are end-exclusive; nudge end to keep BETWEEN semantics
+            prices = self.ticks.ticks(symbol, start, end + pd.Timedelta(microseconds=1))['price']
+            if len(prices):
+                returns[i] = prices[-1] / prices[0] - 1
+            else:
+                missing[symbol] = i
+        if missing:
+            rows = self._read_market_data(missing, '''SELECT symbol, price, first_rn, last_rn FROM (
+                                                        SELECT symbol, price,
+                                                               ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp) AS first_rn,
+                                                               ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) AS last_rn
+                                                        FROM market_data
+                                                        WHERE symbol IN ({symbols}) AND timestamp BETWEEN ? AND ?)
+                                                    WHERE first_rn = 1 OR last_rn = 1''',
+                                          (start.to_pydatetime(), end.to_pydatetime()))
+            if not rows.empty:
+                first = rows[rows['first_rn'] == 1].set_index('symbol')['price']
+                last = rows[rows['last_rn'] == 1].set_index('symbol')['price']
+                for symbol, value in (last / first - 1).dropna().items():
+                    returns[missing[symbol]] = value
+        return returns
+
+    def build_shock_matrix(self, symbols, scenarios, sectors=None):
+        """
+        Turn scenario specs into a scenarios x symbols matrix of price shocks.
+        A spec is a uniform shock (-0.2), a dict with optional 'default', 'sectors'
+        ({sector: shock}) and 'symbols' ({symbol: shock}) keys, or
+        {'replay': (start, end)} to replay each symbol's historical move.
+        """
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+        sector_index = {}
+        for symbol in symbols:
+            if (sectors or {}).get(symbol) is not None:
+                sector_index.setdefault(sectors[symbol], len(sector_index))
+
+        matrix = np.zeros((len(scenarios), len(symbols)))
+        uniform_rows, uniform_shocks = [], []
+        spec_rows, defaults = [], []
+        sector_cells, symbol_cells = [], []
+        for i, spec in enumerate(scenarios):
+            if not isinstance(spec, dict):
+                if np.ndim(spec) == 0:
+                    uniform_rows.append(i)
+                    uniform_shocks.append(spec)
+                else:
+                    matrix[i] = spec
+            elif 'replay' in spec:
+                matrix[i] = self._get_replay_returns(symbols, *spec['replay'])
+            else:
+                row = len(spec_rows)
+                spec_rows.append(i)
+                defaults.append(spec.get('default', 0.0))
+                sector_cells.extend((row, sector_index[sector], shock)
+                                    for sector, shock in spec.get('sectors', {}).items() if sector in sector_index)
+                symbol_cells.extend((i, index[symbol], shock)
+                                    for symbol, shock in spec.get('symbols', {}).items() if symbol in index)
+
+        if uniform_rows:
+            matrix[uniform_rows] = np.asarray(uniform_shocks, dtype=float)[:, None]
+        if spec_rows:
+            # Sector shocks reach symbols through a sectors x symbols one-hot matrix;
+            # symbols whose sector a spec does not shock keep its default
+            members = [(sector_index[sectors[symbol]], j) for j, symbol in enumerate(symbols)
+                       if (sectors or {}).get(symbol) is not None]
+            onehot = np.zeros((len(sector_index), len(symbols)))
+            if members:
+                onehot[tuple(np.array(members).T)] = 1.0
+            shocks = np.zeros((len(spec_rows), len(sector_index)))
+            shocked = np.zeros_like(shocks)
+            if sector_cells:
+                rows, cols, values = zip(*sector_cells)
+                shocks[rows, cols] = values
+                shocked[rows, cols] = 1.0
+            matrix[spec_rows] = np.asarray(defaults, dtype=float)[:, None] * (1 - shocked @ onehot) + shocks @ onehot
+        if symbol_cells:
+            rows, cols, values = zip(*symbol_cells)
+            matrix[list(rows), list(cols)] = values
+        return matrix
+
+    def stress_test(self, user_id, scenarios, sectors=None):
+        """
+        Apply any number of scenarios to a user's portfolio in one matrix product.
+        scenarios is a {name: spec} dict, a list of specs (see build_shock_matrix)
+        or a precomputed scenarios x symbols shock array over the sorted held symbols.
+        Returns {scenario: loss}, with losses as positive numbers, keyed by name or,
+        for a list or array, by position.
+        """
+        holdings = self._get_holdings(user_id)
+        symbols = sorted(set(holdings['symbol']))
+
+        rows = holdings['symbol'].map({symbol: i for i, symbol in enumerate(symbols)}).to_numpy(dtype=int)
+        position_values = holdings['quantity'].to_numpy(dtype=float) * holdings['price'].to_numpy(dtype=float)
+        held = ~np.isnan(position_values)
+        exposure = np.bincount(rows[held], weights=position_values[held], minlength=len(symbols))
+
+        if isinstance(scenarios, np.ndarray):
+            names, shocks = list(range(len(scenarios))), scenarios
+        elif isinstance(scenarios, dict):
+            names = list(scenarios)
+            shocks = self.build_shock_matrix(symbols, list(scenarios.values()), sectors)
+        else:
+            names = list(range(len(scenarios)))
+            shocks = self.build_shock_matrix(symbols, scenarios, sectors)
+
+        losses = -(np.atleast_2d(shocks) @ exposure)
+        return dict(zip(names, losses))
 
     def perform_stress_test(self, user_id, crash_scenarios=[-0.2, -0.5, -0.7]):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
-        results = {}
-        
-        for scenario in crash_scenarios:
-            scenario_loss = 0
-            for _, row in portfolio.iterrows():
-                symbol = row['symbol']
-                quantity = row['quantity']
-                price_data = self._get_historical_prices(symbol)
-                
-                if not price_data.empty:
-                    current_price = price_data['price'].iloc[-1]
-                    crash_price = current_price * (1 + scenario)
-                    loss = quantity * (current_price - crash_price)
-                    scenario_loss += loss
-                    
-            results[scenario] = scenario_loss
-            
-        return results
+        return self.stress_test(user_id, crash_scenarios)
 
     def get_risk_metrics(self, user_id):
-        var, total_value = self.calculate_value_at_risk(user_id)
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
+        result = self.calculate_var(user_id)
+        var, total_value = result['var'], result['total_value']
         
         return {
             'timestamp': datetime.now(),
             'total_portfolio_value': total_value,
             'value_at_risk_95': var,
             'var_percentage': (var/total_value)*100 if total_value > 0 else 0,
-            'position_count': len(portfolio)
+            'position_count': result['position_count']
         }
+
+    def _get_portfolios(self, user_ids=None):
+        if user_ids is None:
+            return pd.read_sql('SELECT user_id, symbol, quantity FROM portfolio', self.portfolio_conn)
+        user_ids = [str(user_id) for user_id in user_ids]
+        chunks = [
+            pd.read_sql(
+                f"SELECT user_id, symbol, quantity FROM portfolio WHERE user_id IN ({','.join('?' * len(chunk))})",
+                self.portfolio_conn, params=chunk
+            )
+            for chunk in (user_ids[i:i + MAX_SQL_PARAMS] for i in range(0, len(user_ids), MAX_SQL_PARAMS))
+        ]
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['user_id', 'symbol', 'quantity'])
+
+    def save_risk_metrics(self, metrics):
+        self.portfolio_db.insert(
+            '''INSERT INTO risk_metrics (user_id, total_portfolio_value, value_at_risk_95, var_percentage,
+                                       portfolio_var, position_count, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            [(m['user_id'], float(m['total_portfolio_value']), float(m['value_at_risk_95']), float(m['var_percentage']),
+              float(m['portfolio_var']), m['position_count'], m['timestamp']) for m in metrics]
+        )
+
+    def compute_all(self, user_ids=None, confidence_level=0.95, days=30, max_workers=None, save=True):
+        """
+        Nightly risk for many users (all users when user_ids is None).
+        Portfolios and the union of held symbols' prices are loaded once, per-symbol
+        return percentiles are computed once, and per-user aggregation is fanned out
+        over a process pool. Results are bulk-inserted into risk_metrics.
+        """
+        portfolios = self._get_portfolios(user_ids)
+        symbols = sorted(set(portfolios['symbol']))
+        prices = self._get_price_matrix(symbols, days)
+        returns = _returns_from_prices(prices)
+
+        percentiles = np.full(len(symbols), np.nan)
+        has_returns = (~np.isnan(returns)).any(axis=1)
+        if has_returns.any():
+            percentiles[has_returns] = np.nanpercentile(returns[has_returns], 100 * (1 - confidence_level), axis=1)
+        last_prices = prices[:, -1]
+
+        portfolios['row'] = portfolios['symbol'].map({symbol: i for i, symbol in enumerate(symbols)})
+        tasks = []
+        for user_id, holdings in portfolios.groupby('user_id', sort=False):
+            rows = holdings['row'].to_numpy(dtype=int)
+            tasks.append((
+                user_id, len(holdings), holdings['quantity'].to_numpy(dtype=float),
+                last_prices[rows], percentiles[rows], returns[rows], confidence_level
+            ))
+
+        if max_workers == 1 or len(tasks) < 2:
+            metrics = list(map(_aggregate_user_risk, tasks))
+        else:
+            workers = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(tasks) // (4 * workers))
+                metrics = list(executor.map(_aggregate_user_risk, tasks, chunksize=chunksize))
+
+        if save:
+            self.save_risk_metrics(metrics)
+        return metrics
@@ -0,0 +1,121 @@
+import json
+import math
+from collections import deque
+from datetime import datetime
+
+def create_symbol_stats(conn):
+    """symbol_stats schema, shared with RiskAnalyzer, which reads it"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS symbol_stats
+                     (symbol TEXT PRIMARY KEY,
+                      last_price REAL,
+                      returns TEXT,
+                      return_count INTEGER,
+                      mean_return REAL,
+                      variance REAL,
+                      volatility REAL,
+                      ewma_volatility REAL,
+                      timestamp DATETIME)''')
+
+class RollingStatsStore:
+    """
+    Per-symbol rolling return statistics updated in O(1) per tick.
+    Keeps the last price, a window of simple returns with running sum/sum of squares
+    (for mean and variance) and an EWMA variance, persisted to symbol_stats.
+    """
+    def __init__(self, db, window=30, ewma_lambda=0.94):
+        self.db = db
+        self.window = window
+        self.ewma_lambda = ewma_lambda
+        self.db.write(self._create_tables)
+        self.state = self._load()
+
+    def _create_tables(self, conn):
+        create_symbol_stats(conn)
+
+    def _load(self):
+        state = {}
+        rows = self.db.connection().execute(
+            'SELECT symbol, last_price, returns, ewma_volatility, timestamp FROM symbol_stats'
+        ).fetchall()
+        for symbol, last_price, returns, ewma_volatility, timestamp in rows:
+            window = deque(json.loads(returns or '[]'), maxlen=self.window)
+            state[symbol] = {
+                'last_price': last_price,
+                'returns': window,
+                # Re-summed on load so floating point drift never outlives a restart
+                'sum': math.fsum(window),
+                'sumsq': math.fsum(r * r for r in window),
+                'ewma_variance': ewma_volatility ** 2 if ewma_volatility is not None else None,
+                'timestamp': timestamp
+            }
+        return state
+
+    def _new_state(self):
+        return {
+            'last_price': None,
+            'returns': deque(maxlen=self.window),
+            'sum': 0.0,
+            'sumsq': 0.0,
+            'ewma_variance': None,
+            'timestamp': None
+        }
+
+    def _apply_tick(self, state, price, timestamp):
+        last_price = state['last_price']
+        if last_price:
+            r = price / last_price - 1
+            returns = state['returns']
+            if len(returns) == returns.maxlen:
+                dropped = returns[0]
+                state['sum'] -= dropped
+                state['sumsq'] -= dropped * dropped
+            returns.append(r)
+            state['sum'] += r
+            state['sumsq'] += r * r
+            if state['ewma_variance'] is None:
+                state['ewma_variance'] = r * r
+            else:
+                state['ewma_variance'] = self.ewma_lambda * state['ewma_variance'] + (1 - self.ewma_lambda) * r * r
+        state['last_price'] = price
+        state['timestamp'] = timestamp
+
+    def _summary(self, symbol, state):
+        n = len(state['returns'])
+        mean = state['sum'] / n if n else None
+        variance = max(state['sumsq'] - n * mean * mean, 0.0) / (n - 1) if n > 1 else None
+        ewma = state['ewma_variance']
+        return {
+            'symbol': symbol,
+            'last_price': state['last_price'],
+            'return_count': n,
+            'mean_return': mean,
+            'variance': variance,
+            'volatility': math.sqrt(variance) if variance is not None else None,
+            'ewma_volatility': math.sqrt(ewma) if ewma is not None else None,
+            'timestamp': state['timestamp']
+        }
+
+    def update(self, ticks):
+        """Apply an iterable of (symbol, price, timestamp) ticks and persist the touched symbols"""
+        touched = {}
+        for symbol, price, timestamp in ticks:
+            state = self.state.get(symbol)
+            if state is None:
+                state = self.state[symbol] = self._new_state()
+            self._apply_tick(state, price, timestamp or datetime.utcnow())
+            touched[symbol] = state
+
+        rows = []
+        for symbol, state in touched.items():
+            s = self._summary(symbol, state)
+            rows.append((symbol, s['last_price'], json.dumps(list(state['returns'])), s['return_count'],
+                         s['mean_return'], s['variance'], s['volatility'], s['ewma_volatility'], s['timestamp']))
+        self.db.insert(
+            'INSERT OR REPLACE INTO symbol_stats (symbol, last_price, returns, return_count, mean_return, variance, '
+            'volatility, ewma_volatility, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+
+    def get(self, symbol):
+        state = self.state.get(symbol)
+        return self._summary(symbol, state) if state else None
@@ -0,0 +1,58 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from agents.storage import MAX_SQL_PARAMS
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class SentimentCache:
+    """Bounded in-memory LRU of text hash -> polarity, backed by a sentiment_cache table; thread-safe"""
+    def __init__(self, db, capacity=10000):
+        self.db = db
+        self.capacity = capacity
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db.write(self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS sentiment_cache
+                         (text_hash TEXT PRIMARY KEY,
+                          polarity REAL)''')
+
+    def _remember(self, items):
+        with self.lock:
+            for key, polarity in items:
+                self.memory[key] = polarity
+                self.memory.move_to_end(key)
+            while len(self.memory) > self.capacity:
+                self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                else:
+                    missing.append(key)
+        for start in range(0, len(missing), MAX_SQL_PARAMS):
+            chunk = missing[start:start + MAX_SQL_PARAMS]
+            rows = self.db.connection().execute(
+                f"SELECT text_hash, polarity FROM sentiment_cache WHERE text_hash IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            found.update(rows)
+            self._remember(rows)
+        return found
+
+    def put_many(self, items):
+        items = list(items)
+        self._remember(items)
+        self.db.insert(
+            'INSERT OR REPLACE INTO sentiment_cache (text_hash, polarity) VALUES (?, ?)',
+            items
+        )
@@ -0,0 +1,158 @@
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from concurrent.futures import Future
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))),
+    ('cache_size', int(os.getenv('SQLITE_CACHE_SIZE', -64000))),  # negative = KiB
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000)
+)
+
+MAX_SQL_PARAMS = 900  # stay under SQLite's host-parameter limit
+
+# Schema aliases used when the agent databases are attached to one connection
+AGENT_SCHEMAS = {
+    'market': 'market_data.db',
+    'portfolio': 'portfolio.db',
+    'conversation': 'conversation.db'
+}
+
+_databases = {}
+_databases_lock = threading.Lock()
+_unified = threading.local()
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+def _executemany(conn, sql, rows):
+    return conn.executemany(sql, rows).rowcount
+
+class _ThreadConnection:
+    """
+    Holds one thread's connection in a threading.local; when the thread exits the
+    local drops the holder and the finalizer closes the connection
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.close = weakref.finalize(self, conn.close)
+
+class Database:
+    """
+    One SQLite file shared by every agent in the process.
+    Readers get a per-thread connection (WAL lets them read while a write is in
+    progress) that is closed when the thread exits; all writes, schema changes
+    included, go through a single writer thread with its own connection, so
+    concurrent Flask threads and ingestion never fight over the write lock.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._readers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+
+    def connection(self):
+        """This thread's read connection; write through write() / insert()"""
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            reader = self._local.reader = _ThreadConnection(connect(self.path))
+            with self._lock:
+                self._readers.add(reader)
+        return reader.conn
+
+    def write(self, fn, *args, wait=True):
+        """
+        Run fn(conn, *args) in one transaction on the writer thread. Blocks for the
+        result unless wait=False, in which case a Future is returned. Calls made from
+        inside a write run inline as part of the enclosing transaction.
+        """
+        if threading.current_thread() is self._writer:
+            return fn(self._writer_conn, *args)
+        future = Future()
+        self._ensure_writer()
+        self._writes.put((fn, args, future))
+        return future.result() if wait else future
+
+    def insert(self, sql, rows, wait=True):
+        """Queue an executemany of rows; returns the affected row count (or a Future)"""
+        rows = list(rows)
+        if not rows:
+            return 0
+        return self.write(_executemany, sql, rows, wait=wait)
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer_conn = connect(self.path)
+                self._writer = threading.Thread(
+                    target=self._write_loop, name=f'sqlite-writer:{os.path.basename(self.path)}', daemon=True
+                )
+                self._writer.start()
+
+    def _write_loop(self):
+        conn = self._writer_conn
+        while True:
+            fn, args, future = self._writes.get()
+            if fn is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with conn:
+                    result = fn(conn, *args)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            writer = self._writer
+            readers = list(self._readers)
+            self._readers = weakref.WeakSet()
+        if writer is not None and writer.is_alive():
+            self._writes.put((None, None, None))
+            writer.join()
+        for reader in readers:
+            reader.close()
+        self._local = threading.local()
+
+def get_database(path):
+    """Shared Database for path, created on first use"""
+    key = os.path.abspath(path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = _databases[key] = Database(path)
+        return database
+
+def unified_enabled():
+    """UNIFIED_DATABASE=1 lets agents join across agent databases in SQL (see unified_connection)"""
+    return os.getenv('UNIFIED_DATABASE', '').lower() in ('1', 'true', 'yes')
+
+def attach_agent_databases(conn):
+    """ATTACH every agent database to conn as market / portfolio / conversation"""
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    for alias, path in AGENT_SCHEMAS.items():
+        if alias not in attached:
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (os.path.abspath(path),))
+    return conn
+
+def unified_connection():
+    """Per-thread read connection with all agent databases attached, for cross-database joins"""
+    reader = getattr(_unified, 'reader', None)
+    if reader is None:
+        conn = sqlite3.connect(':memory:', check_same_thread=False, timeout=5.0)
+        conn.execute('PRAGMA busy_timeout = 5000')
+        reader = _unified.reader = _ThreadConnection(attach_agent_databases(conn))
+    return reader.conn
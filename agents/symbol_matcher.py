@@ -0,0 +1,51 @@
+import re
+
+TOKEN_PATTERN = re.compile(r"\$?[A-Za-z][A-Za-z0-9.&'-]*")
+POSSESSIVE = re.compile(r"'s?$", re.IGNORECASE)
+
+def tokenize(text):
+    """Ticker/word tokens of text with possessives stripped ("AAPL's" -> "AAPL")"""
+    return [POSSESSIVE.sub('', token) for token in TOKEN_PATTERN.findall(text or '')]
+
+class SymbolMatcher:
+    """
+    Dictionary matcher mapping tickers ($AAPL, AAPL) and company aliases
+    ("apple inc") to symbols in a single pass over the text's tokens.
+    Aliases are kept in a token trie, so matching costs O(tokens x longest alias).
+    """
+    def __init__(self, symbols=(), aliases=None):
+        self.symbols = {symbol.upper() for symbol in symbols}
+        self.trie = {}
+        self.max_alias_length = 0
+        for alias, symbol in (aliases or {}).items():
+            self.add_alias(alias, symbol)
+
+    def add_alias(self, alias, symbol):
+        tokens = [token.lower() for token in tokenize(alias)]
+        if not tokens:
+            return
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = symbol.upper()
+        self.max_alias_length = max(self.max_alias_length, len(tokens))
+
+    def find(self, text):
+        tokens = tokenize(text)
+        found = set()
+        lowered = [token.lower() for token in tokens]
+        for i, token in enumerate(tokens):
+            bare = token.lstrip('$').rstrip('.')
+            if token.startswith('$'):
+                bare = bare.upper()
+            # Bare tickers must be written in caps and be 2+ letters so words like "a" don't match
+            if bare in self.symbols and (token.startswith('$') or (bare.isupper() and len(bare) > 1)):
+                found.add(bare)
+            node = self.trie
+            for j in range(i, min(len(tokens), i + self.max_alias_length)):
+                node = node.get(lowered[j])
+                if node is None:
+                    break
+                if None in node:
+                    found.add(node[None])
+        return sorted(found)
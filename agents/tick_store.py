@@ -0,0 +1,329 @@
+import fcntl
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+TICK_DTYPE = np.dtype([('timestamp', 'datetime64[us]'), ('price', '<f8')])
+# ticks is the number of ticks in the bar; the quote feed carries no traded volume
+BAR_DTYPE = np.dtype([
+    ('start', 'datetime64[us]'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('ticks', '<i8')
+])
+# Bar resolution -> (precomputed bars it is rolled up from, numpy datetime unit)
+RESOLUTIONS = {
+    '1m': ('1m', 'm'),
+    '5m': ('1m', '5m'),
+    '15m': ('1m', '15m'),
+    '30m': ('1m', '30m'),
+    '1h': ('1m', 'h'),
+    '4h': ('1m', '4h'),
+    '1d': ('1d', 'D')
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def downsample(ticks, unit):
+    """OHLC bars of a time-sorted tick array at a numpy datetime unit ('m', 'h', 'D', ...)"""
+    if not len(ticks):
+        return np.zeros(0, dtype=BAR_DTYPE)
+    keys = ticks['timestamp'].astype(f'datetime64[{unit}]')
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.append(starts[1:], len(ticks))
+    price = ticks['price']
+    bars = np.empty(len(starts), dtype=BAR_DTYPE)
+    bars['start'] = keys[starts]
+    bars['open'] = price[starts]
+    bars['high'] = np.maximum.reduceat(price, starts)
+    bars['low'] = np.minimum.reduceat(price, starts)
+    bars['close'] = price[ends - 1]
+    bars['ticks'] = ends - starts
+    return bars
+
+def rollup(bars, unit):
+    """Re-aggregate time-sorted bars into coarser bars at a numpy datetime unit"""
+    if not len(bars):
+        return np.zeros(0, dtype=BAR_DTYPE)
+    keys = bars['start'].astype(f'datetime64[{unit}]')
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.append(starts[1:], len(bars))
+    out = np.empty(len(starts), dtype=BAR_DTYPE)
+    out['start'] = keys[starts]
+    out['open'] = bars['open'][starts]
+    out['high'] = np.maximum.reduceat(bars['high'], starts)
+    out['low'] = np.minimum.reduceat(bars['low'], starts)
+    out['close'] = bars['close'][ends - 1]
+    out['ticks'] = np.add.reduceat(bars['ticks'], starts)
+    return out
+
+def bar_records(bars):
+    """JSON-ready dicts of a bar array"""
+    columns = [bars['start'].astype(str).tolist()] + [bars[f].tolist() for f in BAR_DTYPE.names[1:]]
+    return [dict(zip(('time',) + BAR_DTYPE.names[1:], row)) for row in zip(*columns)]
+
+def _sorted(ticks):
+    if len(ticks) > 1 and (np.diff(ticks['timestamp']) < np.timedelta64(0, 'us')).any():
+        return ticks[np.argsort(ticks['timestamp'], kind='stable')]
+    return ticks
+
+def _between(array, field, start, end):
+    """Zero-copy slice of a sorted array with start <= array[field] < end (None = open)"""
+    values = array[field]
+    lo = np.searchsorted(values, np.datetime64(start, 'us'), 'left') if start is not None else 0
+    hi = np.searchsorted(values, np.datetime64(end, 'us'), 'left') if end is not None else len(array)
+    return array[lo:hi]
+
+class TickStore:
+    """
+    Price history partitioned by symbol and day under root/<symbol>/:
+
+      <day>.ticks    open partition: raw (timestamp, price) records, append-only, memory-mapped
+      <day>.npz      sealed partition: compressed columnar timestamp deltas + prices
+      <day>.1m.npy   1-minute bars of a sealed day, memory-mapped
+      1d.npy         1-day bars of every sealed day, memory-mapped
+
+    Timestamps are naive UTC, as MarketData stores them, so days are UTC days.
+    A day is sealed (compressed and downsampled) once a later day's tick arrives
+    for the symbol, or by seal(). Reads of open partitions and bars are zero-copy
+    views; sealed partitions are decompressed once and kept in a small LRU.
+
+    Several processes (the Flask app, ingestion) may share a root: appends and seals
+    take an exclusive flock on root/<symbol>/.lock, partition reads a shared one.
+    """
+    def __init__(self, root, cache_size=64):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._latest_day = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, quote(symbol, safe=''))
+
+    def _path(self, symbol, name):
+        return os.path.join(self._dir(symbol), name)
+
+    @contextmanager
+    def _locked(self, symbol, exclusive=True):
+        # A descriptor per acquisition, so the flock also excludes other threads
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        fd = os.open(self._path(symbol, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _days(self, symbol):
+        try:
+            names = os.listdir(self._dir(symbol))
+        except FileNotFoundError:
+            return []
+        return sorted({name.split('.')[0] for name in names if name.endswith(('.ticks', '.npz'))})
+
+    def symbols(self):
+        return sorted(unquote(name) for name in os.listdir(self.root))
+
+    def append(self, ticks):
+        """Append an iterable of (symbol, price, timestamp) ticks; returns the number written"""
+        groups = {}
+        for symbol, price, timestamp in ticks:
+            groups.setdefault(symbol, []).append((timestamp, price))
+        written = 0
+        for symbol, rows in groups.items():
+            records = np.array(rows, dtype=TICK_DTYPE)
+            days = records['timestamp'].astype('datetime64[D]')
+            latest = str(days.max())
+            with self._locked(symbol):
+                for day in np.unique(days):
+                    with open(self._path(symbol, f'{day}.ticks'), 'ab') as f:
+                        f.write(records[days == day].tobytes())
+                # Only look for partitions to seal when the symbol moves on to a new day
+                with self._lock:
+                    new_day = self._latest_day.get(symbol) != latest
+                    self._latest_day[symbol] = latest
+                if new_day:
+                    self._seal_symbol(symbol, latest)
+            written += len(records)
+        return written
+
+    def seal(self, symbol=None, before=None):
+        """Compress and downsample open partitions older than `before` (default today)"""
+        before = before or str(np.datetime64('today', 'D'))
+        for sym in [symbol] if symbol is not None else self.symbols():
+            with self._locked(sym):
+                self._seal_symbol(sym, before)
+
+    def _seal_symbol(self, symbol, before):
+        # Caller holds the symbol's exclusive lock
+        for day in self._days(symbol):
+            if day < before and os.path.exists(self._path(symbol, f'{day}.ticks')):
+                self._seal_day(symbol, day)
+
+    def _seal_day(self, symbol, day):
+        ticks = np.ascontiguousarray(_sorted(self._load_day(symbol, day)))
+        timestamps = ticks['timestamp'].astype('int64')
+        tmp = self._path(symbol, f'{day}.tmp.npz')
+        np.savez_compressed(tmp, timestamp=np.diff(timestamps, prepend=0), price=ticks['price'])
+        os.replace(tmp, self._path(symbol, f'{day}.npz'))
+        self._save(self._path(symbol, f'{day}.1m.npy'), downsample(ticks, 'm'))
+
+        daily = self._daily_bars(symbol)
+        bar = downsample(ticks, 'D')
+        daily = np.concatenate((daily[daily['start'] != bar['start'][0]], bar))
+        self._save(self._path(symbol, '1d.npy'), daily[np.argsort(daily['start'], kind='stable')])
+
+        os.remove(self._path(symbol, f'{day}.ticks'))
+
+    def _save(self, path, array):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+    def _sealed_day(self, symbol, day):
+        # Keyed by mtime so a day another process re-sealed after late ticks is reloaded
+        path = self._path(symbol, f'{day}.npz')
+        key = (symbol, day, os.stat(path).st_mtime_ns)
+        with self._lock:
+            ticks = self._cache.get(key)
+            if ticks is not None:
+                self._cache.move_to_end(key)
+                return ticks
+        with np.load(path) as data:
+            ticks = np.empty(len(data['price']), dtype=TICK_DTYPE)
+            ticks['timestamp'] = np.cumsum(data['timestamp']).astype('datetime64[us]')
+            ticks['price'] = data['price']
+        with self._lock:
+            self._cache[key] = ticks
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ticks
+
+    def _read_day(self, symbol, day):
+        """Time-sorted ticks of one day: a zero-copy view when only an open partition exists"""
+        # Shared lock: never see a day mid-seal (compressed but its open partition not yet removed)
+        with self._locked(symbol, exclusive=False):
+            return self._load_day(symbol, day)
+
+    def _load_day(self, symbol, day):
+        parts = []
+        if os.path.exists(self._path(symbol, f'{day}.npz')):
+            parts.append(self._sealed_day(symbol, day))
+        path = self._path(symbol, f'{day}.ticks')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size >= TICK_DTYPE.itemsize:
+            parts.append(np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(size // TICK_DTYPE.itemsize,)))
+        if not parts:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        return _sorted(parts[0] if len(parts) == 1 else np.concatenate(parts))
+
+    def _daily_bars(self, symbol):
+        path = self._path(symbol, '1d.npy')
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else np.zeros(0, dtype=BAR_DTYPE)
+
+    def ticks(self, symbol, start=None, end=None):
+        """Ticks with start <= timestamp < end; a view when the range falls in one partition"""
+        days = self._days(symbol)
+        if start is not None:
+            days = [d for d in days if d >= str(np.datetime64(start, 'D'))]
+        if end is not None:
+            days = [d for d in days if d <= str(np.datetime64(end, 'D'))]
+        parts = [_between(self._read_day(symbol, day), 'timestamp', start, end) for day in days]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def last(self, symbol, n):
+        """The most recent n ticks, oldest first"""
+        parts = []
+        remaining = n
+        for day in reversed(self._days(symbol)):
+            if remaining <= 0:
+                break
+            ticks = self._read_day(symbol, day)
+            parts.append(ticks[max(len(ticks) - remaining, 0):])
+            remaining -= len(ticks)
+        if not parts:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts[::-1])
+
+    def latest(self, symbol):
+        """(timestamp, price) of the most recent tick, or None"""
+        ticks = self.last(symbol, 1)
+        if not len(ticks):
+            return None
+        return ticks['timestamp'][0].item(), float(ticks['price'][0])
+
+    def bars(self, symbol, resolution='1m', start=None, end=None, limit=None):
+        """
+        Bars at any RESOLUTIONS key with start <= bar start < end, rolled up from the
+        precomputed 1m/1d bars (open partitions are downsampled on the fly).
+        limit keeps the bars of the most recent `limit` periods; without a start only
+        their partitions are read.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown bar resolution: {resolution}")
+        base, unit = RESOLUTIONS[resolution]
+        if limit is not None:
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+            if start is None:
+                # end is exclusive, the latest tick is not
+                if end is not None:
+                    anchor, periods = end, limit
+                else:
+                    anchor, periods = (self.latest(symbol) or (None,))[0], limit - 1
+                if anchor is not None:
+                    bucket = np.datetime64(anchor, 'us').astype(f'datetime64[{unit}]')
+                    start = (bucket - np.timedelta64(periods, unit)).astype('datetime64[us]')
+            return self.bars(symbol, resolution, start, end)[-limit:]
+        if base != resolution:
+            return rollup(self.bars(symbol, base, start, end), unit)
+        days = self._days(symbol)
+        if start is not None:
+            days = [d for d in days if d >= str(np.datetime64(start, 'D'))]
+        if end is not None:
+            days = [d for d in days if d <= str(np.datetime64(end, 'D'))]
+        open_days = [d for d in days if os.path.exists(self._path(symbol, f'{d}.ticks'))]
+
+        if unit == 'D':
+            # A sealed day that received late ticks is open again and rolled up from its ticks
+            daily = self._daily_bars(symbol)
+            reopened = np.isin(daily['start'].astype('datetime64[D]').astype(str), open_days)
+            parts = [daily[~reopened] if reopened.any() else daily]
+            parts += [downsample(self._read_day(symbol, day), 'D') for day in open_days]
+        else:
+            parts = []
+            for day in days:
+                if day in open_days:
+                    parts.append(downsample(self._read_day(symbol, day), 'm'))
+                else:
+                    parts.append(np.load(self._path(symbol, f'{day}.1m.npy'), mmap_mode='r'))
+        parts = [_between(part, 'start', start, end) for part in parts]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return np.zeros(0, dtype=BAR_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        bars = np.concatenate(parts)
+        return bars[np.argsort(bars['start'], kind='stable')] if unit == 'D' else bars
+
+def get_tick_store(root=None):
+    """Shared TickStore for root (TICK_STORE_PATH, default ./ticks), created on first use"""
+    root = os.path.abspath(root or os.getenv('TICK_STORE_PATH', 'ticks'))
+    with _stores_lock:
+        store = _stores.get(root)
+        if store is None:
+            store = _stores[root] = TickStore(root)
+        return store
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_jwt_extended import (
     JWTManager, create_access_token,
     jwt_required, get_jwt_identity
@@ -26,6 +26,24 @@ swagger = Swagger(app)
 from database import db
 db.init_app(app)
 from models import User, Portfolio, Transaction, MarketData, Recommendation, RiskAnalysis
+from cerebras_client import stats as llm_client_stats
+from llm_dispatcher import BatchLimitExceeded, get_dispatcher
+from ledger import apply_transactions, value_positions
+from pagination import paginated_response
+from transaction_import import import_transactions, validate as validate_transaction
+from valuation import value_portfolio
+from agents.event_bus import get_event_bus
+from agents.quote_cache import get_quote_cache
+from agents.storage import get_database
+from agents.tick_store import RESOLUTIONS, bar_records, get_tick_store
+
+tick_store = get_tick_store()
+quote_cache = get_quote_cache()
+event_bus = get_event_bus()
+# Every quote change, from this process or (with QUOTE_CACHE_PATH) the ingestion process, fans out once
+quote_cache.subscribe(lambda symbol, quote, previous: event_bus.publish(
+    'quote', {'symbol': symbol, 'price': quote['price'], 'timestamp': quote['timestamp'].isoformat()}, symbol=symbol
+))
 
 jwt = JWTManager(app)
 
@@ -112,16 +130,36 @@ def portfolios():
     ---
     security:
       - Bearer: []
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default 100, max 1000)
+      - name: cursor
+        in: query
+        type: string
+        description: X-Next-Cursor header of the previous page
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated columns to return
+      - name: start
+        in: query
+        type: string
+        format: date-time
+      - name: end
+        in: query
+        type: string
+        format: date-time
     responses:
       200:
-        description: List of portfolios
+        description: Newest-first page of portfolios
       201:
         description: Portfolio created
     """
     user_id = get_jwt_identity()
     if request.method == 'GET':
-        portfolios = Portfolio.query.filter_by(user_id=user_id).all()
-        return jsonify([p.to_dict() for p in portfolios]), 200
+        return paginated_response(Portfolio, user_id, request.args)
     
     data = request.get_json()
     portfolio = Portfolio(
@@ -172,6 +210,21 @@ def portfolio(id):
         db.session.commit()
         return jsonify({"message": "Portfolio deleted"}), 200
 
+@app.route('/portfolios/valuation', methods=['GET'])
+@jwt_required()
+def portfolio_valuation():
+    """
+    Value all of the user's holdings at the latest prices in one response
+    ---
+    security:
+      - Bearer: []
+    responses:
+      200:
+        description: Totals, concentration and per-symbol market value, weight and unrealized P&L
+    """
+    user_id = get_jwt_identity()
+    return jsonify(value_portfolio(user_id)), 200
+
 # Transaction routes
 @app.route('/transactions', methods=['GET', 'POST'])
 @jwt_required()
@@ -181,43 +234,153 @@ def transactions():
     ---
     security:
       - Bearer: []
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default 100, max 1000)
+      - name: cursor
+        in: query
+        type: string
+        description: X-Next-Cursor header of the previous page
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated columns to return
+      - name: start
+        in: query
+        type: string
+        format: date-time
+      - name: end
+        in: query
+        type: string
+        format: date-time
     responses:
       200:
-        description: List of transactions
+        description: Newest-first page of transactions
       201:
         description: Transaction created
+      400:
+        description: Invalid transaction
     """
     user_id = get_jwt_identity()
     if request.method == 'GET':
-        transactions = Transaction.query.filter_by(user_id=user_id).all()
-        return jsonify([t.to_dict() for t in transactions]), 200
+        return paginated_response(Transaction, user_id, request.args)
     
-    data = request.get_json()
-    transaction = Transaction(
-        user_id=user_id,
-        stock_symbol=data['stock_symbol'],
-        action=data['action'],
-        quantity=data['quantity'],
-        price=data['price']
-    )
+    # Same rules as the bulk import: upper-case symbol, BUY/SELL, positive whole quantity
+    try:
+        mapping = validate_transaction(request.get_json(silent=True), user_id)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    apply_transactions(user_id, [mapping])
+    transaction = Transaction(**mapping)
     db.session.add(transaction)
     db.session.commit()
     return jsonify(transaction.to_dict()), 201
 
+@app.route('/transactions/import', methods=['POST'])
+@jwt_required()
+def import_transactions_route():
+    """
+    Bulk import transactions from a CSV or NDJSON upload
+    ---
+    security:
+      - Bearer: []
+    consumes:
+      - text/csv
+      - application/x-ndjson
+      - multipart/form-data
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+        description: Defaults from the Content-Type or the uploaded file's extension
+      - name: file
+        in: formData
+        type: file
+        description: Upload as multipart instead of a raw body
+    responses:
+      200:
+        description: Import report with per-line errors and throughput
+      400:
+        description: Unknown format
+      422:
+        description: The upload became unreadable (not UTF-8 / valid CSV); the report's
+          'aborted' gives the line reading stopped at; the lines before it were imported
+    """
+    user_id = get_jwt_identity()
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    format = request.args.get('format')
+    if not format:
+        name = (upload.filename or '') if upload else ''
+        if name.endswith(('.ndjson', '.jsonl')) or request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            format = 'ndjson'
+        elif name.endswith('.csv') or request.mimetype == 'text/csv':
+            format = 'csv'
+    if format not in ('csv', 'ndjson'):
+        return jsonify({"message": "format must be csv or ndjson"}), 400
+    report = import_transactions(stream, format, user_id)
+    return jsonify(report), 422 if report['aborted'] else 200
+
+@app.route('/positions', methods=['GET'])
+@jwt_required()
+def positions():
+    """
+    Positions derived from the user's transactions, valued at the latest prices
+    ---
+    security:
+      - Bearer: []
+    responses:
+      200:
+        description: Quantity, cost basis, realized and unrealized P&L per symbol
+    """
+    user_id = get_jwt_identity()
+    return jsonify(value_positions(user_id)), 200
+
 # Market data routes
 @app.route('/market-data', methods=['POST', 'GET'])
 @jwt_required()
 def market_data():
     """
-    Add or get market data
+    Add market data, or get the latest quote or OHLC bars
     ---
     security:
       - Bearer: []
+    parameters:
+      - name: symbol
+        in: query
+        type: string
+        description: Symbol for the latest quote
+      - name: symbols
+        in: query
+        type: string
+        description: Comma-separated symbols for bars
+      - name: resolution
+        in: query
+        type: string
+        enum: [1m, 5m, 15m, 30m, 1h, 4h, 1d]
+        description: Bar resolution; returns bars instead of the latest quote
+      - name: start
+        in: query
+        type: string
+        format: date-time
+      - name: end
+        in: query
+        type: string
+        format: date-time
+      - name: limit
+        in: query
+        type: integer
+        description: Bars of the most recent periods per symbol (default 1000, max 10000)
     responses:
       200:
-        description: Market data retrieved
+        description: Latest quote, or bars per symbol (ticks is the tick count per bar)
       201:
         description: Market data added
+      400:
+        description: Invalid query parameters
     """
     if request.method == 'POST':
         data = request.get_json()
@@ -227,11 +390,45 @@ def market_data():
         )
         db.session.add(market_data)
         db.session.commit()
+        tick = (market_data.symbol, market_data.price, market_data.timestamp)
+        tick_store.append([tick])
+        quote_cache.update([tick])
         return jsonify(market_data.to_dict()), 201
     
     if request.method == 'GET':
-        data = request.get_json()
-        market_data = MarketData.query.filter_by(symbol=data['symbol']).order_by(MarketData.timestamp.desc()).first()
+        resolution = request.args.get('resolution')
+        if resolution:
+            symbols = [s for s in request.args.get('symbols', request.args.get('symbol', '')).split(',') if s]
+            if not symbols:
+                return jsonify({"message": "No symbols provided"}), 400
+            if resolution not in RESOLUTIONS:
+                return jsonify({"message": f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+            try:
+                start = datetime.datetime.fromisoformat(request.args['start']) if 'start' in request.args else None
+                end = datetime.datetime.fromisoformat(request.args['end']) if 'end' in request.args else None
+                limit = min(int(request.args.get('limit', 1000)), 10000)
+            except ValueError:
+                return jsonify({"message": "start/end must be ISO 8601 timestamps and limit an integer"}), 400
+            if limit < 1:
+                return jsonify({"message": "limit must be at least 1"}), 400
+            bars = {symbol: bar_records(tick_store.bars(symbol, resolution, start, end, limit)) for symbol in symbols}
+            return jsonify({"resolution": resolution, "bars": bars}), 200
+
+        # Latest quote; the symbol may also come from a JSON body for older clients
+        symbol = request.args.get('symbol') or (request.get_json(silent=True) or {}).get('symbol')
+        if not symbol:
+            return jsonify({"message": "No symbol provided"}), 400
+        # A stale quote may just mean ingestion runs in another process; the stores have its ticks
+        quote = quote_cache.get(symbol)
+        if quote and not quote['stale']:
+            return jsonify({'symbol': symbol, 'price': quote['price'], 'timestamp': quote['timestamp'].isoformat(),
+                            'stale': False}), 200
+        latest = tick_store.latest(symbol)
+        if latest:
+            timestamp, price = latest
+            return jsonify({'symbol': symbol, 'price': price, 'timestamp': timestamp.isoformat()}), 200
+        # Rows written before the tick store existed until backfill_ticks.py has run
+        market_data = MarketData.query.filter_by(symbol=symbol).order_by(MarketData.timestamp.desc()).first()
         if market_data:
             return jsonify(market_data.to_dict()), 200
         return jsonify({"message": "No data found"}), 404
@@ -245,9 +442,30 @@ def recommendations():
     ---
     security:
       - Bearer: []
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default 100, max 1000)
+      - name: cursor
+        in: query
+        type: string
+        description: X-Next-Cursor header of the previous page
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated columns to return
+      - name: start
+        in: query
+        type: string
+        format: date-time
+      - name: end
+        in: query
+        type: string
+        format: date-time
     responses:
       200:
-        description: List of recommendations
+        description: Newest-first page of recommendations
       201:
         description: Recommendation created
     """
@@ -260,11 +478,11 @@ def recommendations():
         )
         db.session.add(recommendation)
         db.session.commit()
+        event_bus.publish('recommendation', recommendation.to_dict(), user_id=user_id)
         return jsonify(recommendation.to_dict()), 201
     
     if request.method == 'GET':
-        recommendations = Recommendation.query.filter_by(user_id=user_id).all()
-        return jsonify([r.to_dict() for r in recommendations]), 200
+        return paginated_response(Recommendation, user_id, request.args)
 
 # Risk analysis routes
 @app.route('/risk-analyses', methods=['POST', 'GET'])
@@ -275,9 +493,30 @@ def risk_analyses():
     ---
     security:
       - Bearer: []
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default 100, max 1000)
+      - name: cursor
+        in: query
+        type: string
+        description: X-Next-Cursor header of the previous page
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated columns to return
+      - name: start
+        in: query
+        type: string
+        format: date-time
+      - name: end
+        in: query
+        type: string
+        format: date-time
     responses:
       200:
-        description: List of risk analyses
+        description: Newest-first page of risk analyses
       201:
         description: Risk analysis created
     """
@@ -291,11 +530,233 @@ def risk_analyses():
         )
         db.session.add(risk_analysis)
         db.session.commit()
+        event_bus.publish('risk', risk_analysis.to_dict(), user_id=user_id)
         return jsonify(risk_analysis.to_dict()), 201
     
     if request.method == 'GET':
-        analyses = RiskAnalysis.query.filter_by(user_id=user_id).all()
-        return jsonify([a.to_dict() for a in analyses]), 200
+        return paginated_response(RiskAnalysis, user_id, request.args)
+
+# Streaming routes
+STREAM_TOPICS = ('quote', 'recommendation', 'risk')
+
+@app.route('/stream', methods=['GET'])
+# A browser EventSource cannot set headers, so the token may also come as ?jwt=<token>
+@jwt_required(locations=['headers', 'query_string'])
+def stream():
+    """
+    Server-Sent Events stream of quote ticks and the user's new recommendations and risk analyses
+    ---
+    security:
+      - Bearer: []
+    parameters:
+      - name: jwt
+        in: query
+        type: string
+        description: Access token, for clients such as EventSource that cannot send an Authorization header
+      - name: symbols
+        in: query
+        type: string
+        description: Comma-separated symbols to receive quotes for (default all)
+      - name: topics
+        in: query
+        type: string
+        description: Comma-separated subset of quote, recommendation, risk (default all)
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: Event stream
+      400:
+        description: Unknown topic
+    """
+    user_id = get_jwt_identity()
+    topics = [t for t in request.args.get('topics', ','.join(STREAM_TOPICS)).split(',') if t]
+    if set(topics) - set(STREAM_TOPICS):
+        return jsonify({"message": f"topics must be among {', '.join(STREAM_TOPICS)}"}), 400
+    symbols = [s for s in request.args.get('symbols', '').split(',') if s]
+
+    # Agent-written rows reach the bus through one poller per table per process
+    event_bus.watch_table(get_database('market_data.db'), 'recommendations', 'recommendation')
+    event_bus.watch_table(get_database('portfolio.db'), 'risk_metrics', 'risk')
+    subscription = event_bus.subscribe(topics, user_id=user_id, symbols=symbols)
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = subscription.get(timeout=15)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                topic, data = event
+                yield f'event: {topic}\ndata: {json.dumps(data, default=str)}\n\n'
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# LLM routes
+MAX_LLM_TOKENS = 4096
+MAX_LLM_TEMPERATURE = 2.0
+
+def _llm_options(data):
+    """max_tokens / temperature of an LLM request body; raises ValueError when out of type or range"""
+    try:
+        max_tokens = float(data.get('max_tokens', 150))
+        temperature = float(data.get('temperature', 0.7))
+    except (TypeError, ValueError):
+        raise ValueError("max_tokens must be an integer and temperature a number")
+    if not max_tokens.is_integer() or not 1 <= max_tokens <= MAX_LLM_TOKENS:
+        raise ValueError(f"max_tokens must be a whole number from 1 to {MAX_LLM_TOKENS}")
+    if not 0 <= temperature <= MAX_LLM_TEMPERATURE:
+        raise ValueError(f"temperature must be between 0 and {MAX_LLM_TEMPERATURE}")
+    return {'max_tokens': int(max_tokens), 'temperature': temperature}
+
+@app.route('/llm/generate', methods=['POST'])
+@jwt_required()
+def llm_generate():
+    """
+    Generate text with the LLM, streamed token by token unless stream is false
+    ---
+    security:
+      - Bearer: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            prompt:
+              type: string
+            max_tokens:
+              type: integer
+            temperature:
+              type: number
+            stream:
+              type: boolean
+    produces:
+      - text/event-stream
+      - application/json
+    responses:
+      200:
+        description: SSE token events followed by done, or the whole response as JSON
+      400:
+        description: No prompt provided, or max_tokens / temperature invalid
+      502:
+        description: The LLM request failed (non-streaming)
+    """
+    data = request.get_json()
+    if not data or not data.get('prompt'):
+        return jsonify({"message": "No prompt provided"}), 400
+    try:
+        options = _llm_options(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    dispatcher = get_dispatcher()
+    if not data.get('stream', True):
+        try:
+            return jsonify({"response": dispatcher.generate_text(data['prompt'], 'interactive', **options)}), 200
+        except Exception as e:
+            return jsonify({"message": f"LLM request failed: {e}"}), 502
+
+    def events():
+        try:
+            # Through the dispatcher, so streams count against its concurrency limit
+            for token in dispatcher.stream_text(data['prompt'], 'interactive', **options):
+                yield f'event: token\ndata: {json.dumps({"token": token})}\n\n'
+            yield 'event: done\ndata: {}\n\n'
+        except Exception as e:
+            yield f'event: error\ndata: {json.dumps({"message": str(e)})}\n\n'
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/llm/batch', methods=['POST'])
+@jwt_required()
+def llm_batch():
+    """
+    Queue many prompts at batch priority and get a batch id to collect the results
+    ---
+    security:
+      - Bearer: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            prompts:
+              type: array
+              items:
+                type: string
+            max_tokens:
+              type: integer
+            temperature:
+              type: number
+    responses:
+      202:
+        description: Batch accepted
+      400:
+        description: No prompts provided, too many prompts, or max_tokens / temperature invalid
+      429:
+        description: Too many of the user's batch prompts are still outstanding
+    """
+    data = request.get_json()
+    prompts = (data or {}).get('prompts')
+    if not prompts or not isinstance(prompts, list):
+        return jsonify({"message": "No prompts provided"}), 400
+    try:
+        options = _llm_options(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        batch_id = get_dispatcher().submit_batch([str(p) for p in prompts], owner=get_jwt_identity(), **options)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except BatchLimitExceeded as e:
+        return jsonify({"message": str(e)}), 429
+    return jsonify({"batch_id": batch_id, "total": len(prompts)}), 202
+
+@app.route('/llm/batch/<batch_id>', methods=['GET'])
+@jwt_required()
+def llm_batch_status(batch_id):
+    """
+    Progress of a batch, with results in prompt order once complete
+    ---
+    security:
+      - Bearer: []
+    parameters:
+      - name: batch_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Batch progress and results
+      404:
+        description: Batch not found
+    """
+    status = get_dispatcher().batch_status(batch_id)
+    if status is None or status.pop('owner') != get_jwt_identity():
+        return jsonify({"message": "Batch not found"}), 404
+    return jsonify(status), 200
+
+@app.route('/llm/stats', methods=['GET'])
+@jwt_required()
+def llm_stats():
+    """
+    LLM client cache/latency and dispatcher queue metrics
+    ---
+    security:
+      - Bearer: []
+    responses:
+      200:
+        description: Client and dispatcher metrics
+    """
+    return jsonify({"client": llm_client_stats(), "dispatcher": get_dispatcher().metrics()}), 200
 
 # Vector database routes
 @app.route('/vector/news', methods=['POST', 'GET'])
@@ -0,0 +1,18 @@
+import sys
+from agents.market_insight_agent import MarketInsightAgent
+
+def report_progress(processed, total):
+    print(f"Scored {processed}/{total} articles ({100 * processed / total:.1f}%)")
+
+def main():
+    chunk_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    agent = MarketInsightAgent()
+    try:
+        processed = agent.backfill(chunk_size=chunk_size, progress=report_progress)
+    finally:
+        agent.close()
+    print(f"Sentiment backfill complete: {processed} articles")
+
+# Guarded: the agent's process pool re-imports this module in its workers under spawn
+if __name__ == '__main__':
+    main()
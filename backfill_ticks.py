@@ -0,0 +1,47 @@
+"""
+Copy market_data rows from a SQLite database into the tick store.
+
+    python backfill_ticks.py                      # market_data.db
+    python backfill_ticks.py instance/app.db      # the Flask app's database
+
+Only rows older than each symbol's first stored tick are copied, so the script
+can be re-run safely after ingestion has started writing to the store.
+"""
+import sqlite3
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from agents.tick_store import get_tick_store
+
+path = sys.argv[1] if len(sys.argv) > 1 else 'market_data.db'
+chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+store = get_tick_store()
+conn = sqlite3.connect(path)
+cutoffs = {}
+for symbol in store.symbols():
+    first = store.ticks(symbol)[:1]
+    if len(first):
+        cutoffs[symbol] = first['timestamp'][0]
+
+# Keyset over rowid; days that receive older ticks after sealing are merged on the next seal
+last_rowid = 0
+copied = 0
+query = '''SELECT rowid, symbol, price, timestamp FROM market_data
+           WHERE rowid > ? ORDER BY rowid LIMIT ?'''
+while True:
+    chunk = conn.execute(query, (last_rowid, chunk_size)).fetchall()
+    if not chunk:
+        break
+    last_rowid = chunk[-1][0]
+    copied += store.append(
+        (symbol, price, timestamp) for _, symbol, price, timestamp in chunk
+        if timestamp is not None and price is not None
+        and (symbol not in cutoffs or np.datetime64(timestamp, 'us') < cutoffs[symbol])
+    )
+    print(f"{datetime.now():%H:%M:%S} copied {copied} ticks (rowid {last_rowid})")
+
+store.seal()
+print(f"Tick backfill complete: {copied} ticks from {path}")
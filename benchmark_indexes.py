@@ -0,0 +1,97 @@
+"""
+Query latency of the agents' hot queries before and after the index migrations.
+
+    python benchmark_indexes.py                      # 1M, 10M and 100M rows
+    python benchmark_indexes.py 100000 1000000       # custom sizes
+
+Each size builds a scratch SQLite file with that many rows in market_data, portfolio,
+conversation_history and sentiment_reports (100M rows needs tens of GB of disk).
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from agents.migrations import MIGRATIONS, _apply
+from agents.storage import PRAGMAS
+
+SYMBOLS = 5000
+USERS = 50000
+
+QUERIES = [
+    ('market_data by symbol, latest 30',
+     'SELECT timestamp, price FROM market_data WHERE symbol = ? ORDER BY timestamp DESC LIMIT 30',
+     lambda: ('S%d' % random.randrange(SYMBOLS),)),
+    ('portfolio by user',
+     'SELECT * FROM portfolio WHERE user_id = ?',
+     lambda: ('U%d' % random.randrange(USERS),)),
+    ('conversation_history by user, latest 5',
+     'SELECT * FROM conversation_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT 5',
+     lambda: ('U%d' % random.randrange(USERS),)),
+    ('sentiment_reports latest 5',
+     'SELECT * FROM sentiment_reports ORDER BY timestamp DESC LIMIT 5',
+     lambda: ())
+]
+
+def build(path, rows):
+    conn = sqlite3.connect(path)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    conn.executescript('''
+        CREATE TABLE market_data (id INTEGER PRIMARY KEY, symbol TEXT, price REAL, timestamp DATETIME);
+        CREATE TABLE portfolio (id INTEGER PRIMARY KEY, user_id TEXT, symbol TEXT, quantity REAL,
+                                purchase_price REAL, timestamp DATETIME);
+        CREATE TABLE conversation_history (id INTEGER PRIMARY KEY, user_id TEXT, question TEXT, answer TEXT,
+                                           timestamp DATETIME);
+        CREATE TABLE sentiment_reports (id INTEGER PRIMARY KEY, article_id INTEGER, summary TEXT,
+                                        sentiment_polarity REAL, sentiment_label TEXT, timestamp DATETIME);
+    ''')
+    seq = f'WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < {rows - 1}) '
+    ts = "datetime(1600000000 + i, 'unixepoch')"
+    with conn:
+        conn.execute(seq + f'''INSERT INTO market_data (symbol, price, timestamp)
+                               SELECT 'S' || (i % {SYMBOLS}), 100 + (i % 1000) / 10.0, {ts} FROM seq''')
+        conn.execute(seq + f'''INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp)
+                               SELECT 'U' || (i % {USERS}), 'S' || (i % {SYMBOLS}), 10, 100, {ts} FROM seq''')
+        conn.execute(seq + f'''INSERT INTO conversation_history (user_id, question, answer, timestamp)
+                               SELECT 'U' || (i % {USERS}), 'q', 'a', {ts} FROM seq''')
+        conn.execute(seq + f'''INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp)
+                               SELECT i, 's', 0.0, 'neutral', {ts} FROM seq''')
+    return conn
+
+def time_queries(conn, repeats):
+    results = {}
+    for label, sql, params in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            conn.execute(sql, params()).fetchall()
+            samples.append(time.perf_counter() - start)
+        results[label] = statistics.median(samples)
+    return results
+
+def main(sizes):
+    migrations = [m for file_migrations in MIGRATIONS.values() for m in file_migrations]
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            start = time.perf_counter()
+            conn = build(path, rows)
+            print(f'\n{rows:,} rows per table (built in {time.perf_counter() - start:.1f}s)')
+            before = time_queries(conn, repeats=3)
+            start = time.perf_counter()
+            with conn:
+                _apply(conn, migrations)
+            print(f'migrations applied in {time.perf_counter() - start:.1f}s')
+            after = time_queries(conn, repeats=200)
+            print(f'{"query":<42}{"no index (ms)":>15}{"indexed (ms)":>15}{"speedup":>10}')
+            for label in before:
+                print(f'{label:<42}{before[label] * 1000:>15.3f}{after[label] * 1000:>15.3f}'
+                      f'{before[label] / after[label]:>9.0f}x')
+            conn.close()
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000000, 10000000, 100000000])
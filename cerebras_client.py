@@ -1,33 +1,225 @@
+import hashlib
+import json
 import os
-import requests
+import threading
+import time
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
+from agents.storage import get_database
+from http_client import PooledHTTPClient
 
 load_dotenv()
 
 OLLAMA_HOST = os.getenv('OLLAMA_HOST')
 OLLAMA_MODEL = 'llama3'  # Default model - user can change in .env if needed
+OLLAMA_TIMEOUT = (float(os.getenv('OLLAMA_CONNECT_TIMEOUT', 3.05)), float(os.getenv('OLLAMA_READ_TIMEOUT', 120)))
 
-def generate_recommendation(prompt, max_tokens=150):
+# Generation is side-effect free, so POSTs are retried on connection errors and 5xx/429 too.
+# A read timeout means the model may still be generating: fail rather than resubmit, so one
+# call is bounded by a single OLLAMA_READ_TIMEOUT.
+http = PooledHTTPClient(
+    pool_size=int(os.getenv('OLLAMA_POOL_SIZE', 8)),
+    timeout=OLLAMA_TIMEOUT,
+    retries=int(os.getenv('OLLAMA_RETRIES', 2)),
+    retry_methods=frozenset({'POST'}),
+    read_retries=0
+)
+
+class ResponseCache:
+    """
+    Prompt-keyed LLM responses with a TTL: an in-memory LRU, optionally backed by
+    an llm_cache table in a SQLite file so entries survive restarts
+    """
+    def __init__(self, capacity=1024, ttl=3600, path=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = get_database(path)
+            self.db.write(self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache
+                         (key TEXT PRIMARY KEY,
+                          response TEXT,
+                          expires REAL)''')
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.memory.move_to_end(key)
+                    return entry[0]
+                del self.memory[key]
+        if self.db is None:
+            return None
+        row = self.db.connection().execute(
+            'SELECT response, expires FROM llm_cache WHERE key = ? AND expires > ?', (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def _remember(self, key, response, expires):
+        with self.lock:
+            self.memory[key] = (response, expires)
+            self.memory.move_to_end(key)
+            if len(self.memory) > self.capacity:
+                self.memory.popitem(last=False)
+
+    def put(self, key, response):
+        expires = time.time() + self.ttl
+        self._remember(key, response, expires)
+        if self.db is not None:
+            self.db.insert('INSERT OR REPLACE INTO llm_cache (key, response, expires) VALUES (?, ?, ?)',
+                           [(key, response, expires)], wait=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if self.db is not None:
+            self.db.write(lambda conn: conn.execute('DELETE FROM llm_cache'))
+
+cache = ResponseCache(
+    capacity=int(os.getenv('LLM_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('LLM_CACHE_TTL', 3600)),
+    path=os.getenv('LLM_CACHE_PATH') or None
+)
+
+_stats = {'requests': 0, 'cache_hits': 0, 'cache_misses': 0, 'errors': 0}
+_latencies = deque(maxlen=1000)
+_first_token_latencies = deque(maxlen=1000)
+_stats_lock = threading.Lock()
+
+def _record(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+def _observe(latency, samples=_latencies):
+    with _stats_lock:
+        samples.append(latency)
+
+def _percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+
+def stats():
+    """Request, cache hit-rate, inference and streaming first-token latency (seconds, last 1000 calls) figures"""
+    with _stats_lock:
+        result = dict(_stats)
+        latencies = sorted(_latencies)
+        first_tokens = sorted(_first_token_latencies)
+    lookups = result['cache_hits'] + result['cache_misses']
+    result['hit_rate'] = result['cache_hits'] / lookups if lookups else None
+    result['latency_p50'] = _percentile(latencies, 0.5)
+    result['latency_p95'] = _percentile(latencies, 0.95)
+    result['latency_mean'] = sum(latencies) / len(latencies) if latencies else None
+    result['first_token_p50'] = _percentile(first_tokens, 0.5)
+    result['first_token_p95'] = _percentile(first_tokens, 0.95)
+    return result
+
+def cache_key(prompt, max_tokens, temperature, model=OLLAMA_MODEL):
+    raw = json.dumps([model, prompt, int(max_tokens), float(temperature)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def generate_recommendation(prompt, max_tokens=150, temperature=0.7, use_cache=None, raise_errors=False):
     """
     Generate AI recommendation using Ollama LLM
-    Returns generated text
+    Returns generated text. Responses are cached when temperature is 0, or when
+    use_cache=True; use_cache=False always runs inference. Request errors come back
+    as an "Error: ..." string unless raise_errors=True.
     """
+    _record('requests')
+    cacheable = use_cache if use_cache is not None else temperature == 0
+    key = cache_key(prompt, max_tokens, temperature) if cacheable else None
+    if key:
+        cached = cache.get(key)
+        _record('cache_hits' if cached is not None else 'cache_misses')
+        if cached is not None:
+            return cached
     try:
-        response = requests.post(
+        start = time.perf_counter()
+        response = http.post(
             f'http://{OLLAMA_HOST}/api/generate',
             json={
                 'model': OLLAMA_MODEL,
                 'prompt': prompt,
+                'stream': False,
                 'options': {
                     'num_predict': max_tokens,
-                    'temperature': 0.7
+                    'temperature': temperature
                 }
             }
         )
         response.raise_for_status()
-        return response.json()['response'].strip()
+        text = response.json()['response'].strip()
+        _observe(time.perf_counter() - start)
     except Exception as e:
+        _record('errors')
+        if raise_errors:
+            raise
         return f"Error: {str(e)}"
+    if key:
+        cache.put(key, text)
+    return text
+
+def stream_recommendation(prompt, max_tokens=150, temperature=0.7, use_cache=None):
+    """
+    Generator of response text fragments as Ollama produces them, read incrementally
+    from its NDJSON stream. Caching follows generate_recommendation; a cached
+    response is yielded whole. Request errors are raised to the caller.
+    """
+    _record('requests')
+    cacheable = use_cache if use_cache is not None else temperature == 0
+    key = cache_key(prompt, max_tokens, temperature) if cacheable else None
+    if key:
+        cached = cache.get(key)
+        _record('cache_hits' if cached is not None else 'cache_misses')
+        if cached is not None:
+            yield cached
+            return
+
+    start = time.perf_counter()
+    parts = []
+    try:
+        with http.post(
+            f'http://{OLLAMA_HOST}/api/generate',
+            json={
+                'model': OLLAMA_MODEL,
+                'prompt': prompt,
+                'stream': True,
+                'options': {
+                    'num_predict': max_tokens,
+                    'temperature': temperature
+                }
+            },
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+                token = chunk.get('response', '')
+                if token:
+                    if not parts:
+                        _observe(time.perf_counter() - start, _first_token_latencies)
+                    parts.append(token)
+                    yield token
+                if chunk.get('done'):
+                    break
+    except Exception:
+        _record('errors')
+        raise
+    _observe(time.perf_counter() - start)
+    if key:
+        cache.put(key, ''.join(parts).strip())
 
 def analyze_risk(portfolio_data):
     """
@@ -35,7 +227,8 @@ def analyze_risk(portfolio_data):
     Returns risk score (0-100) and explanation
     """
     prompt = f"Analyze risk for portfolio: {portfolio_data}. Provide risk score (0-100) and explanation."
-    response = generate_recommendation(prompt)
+    # Deterministic, so an unchanged portfolio is answered from the cache
+    response = generate_recommendation(prompt, temperature=0)
     
     # Simple parsing - in production would use proper JSON parsing
     risk_score = 50  # Default value
@@ -0,0 +1,30 @@
+"""
+Nightly risk metrics for every portfolio, saved to risk_metrics.
+
+    python compute_risk.py              # every user
+    python compute_risk.py u12 u42      # selected user ids
+
+Meant to run from cron after the market closes, e.g.
+
+    30 22 * * 1-5  cd /srv/backend && python compute_risk.py
+
+RISK_CONFIDENCE (default 0.95), RISK_DAYS (default 30) and RISK_WORKERS (default
+one process per CPU) tune the run.
+"""
+import os
+import sys
+import time
+
+from agents.risk_analyzer import RiskAnalyzer
+
+if __name__ == '__main__':
+    user_ids = sys.argv[1:] or None
+    workers = os.getenv('RISK_WORKERS')
+    start = time.perf_counter()
+    metrics = RiskAnalyzer().compute_all(
+        user_ids,
+        confidence_level=float(os.getenv('RISK_CONFIDENCE', 0.95)),
+        days=int(os.getenv('RISK_DAYS', 30)),
+        max_workers=int(workers) if workers else None
+    )
+    print(f"Risk metrics saved for {len(metrics)} users in {time.perf_counter() - start:.1f}s")
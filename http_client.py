@@ -0,0 +1,80 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `burst`"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class PooledHTTPClient:
+    """
+    Keep-alive requests session with a bounded connection pool, default timeouts,
+    retry with exponential backoff and optional per-host rate limiting.
+    read_retries caps retries after the request was sent (read errors/timeouts);
+    None leaves them to `retries`.
+    """
+    def __init__(self, pool_size=32, timeout=(3.05, 10), retries=3, backoff_factor=0.5,
+                 rate_limit=None, retry_methods=Retry.DEFAULT_ALLOWED_METHODS, read_retries=None):
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.rate_limiters = {}
+        self._limiters_lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            read=read_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=retry_methods,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _throttle(self, url):
+        if not self.rate_limit:
+            return
+        host = urlsplit(url).netloc
+        with self._limiters_lock:
+            limiter = self.rate_limiters.get(host)
+            if limiter is None:
+                limiter = self.rate_limiters[host] = RateLimiter(self.rate_limit)
+        limiter.acquire()
+
+    def request(self, method, url, **kwargs):
+        self._throttle(url)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
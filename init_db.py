@@ -3,4 +3,8 @@ from models import User, Portfolio, Transaction, MarketData, Recommendation, Ris
 
 with app.app_context():
     db.create_all()
+    # create_all skips tables that already exist, so add any indexes they are missing
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
     print("Database tables created successfully")
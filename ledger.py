@@ -0,0 +1,156 @@
+import json
+import os
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from agents.quote_cache import latest_prices
+from database import db
+from models import Position, Transaction
+
+COST_METHODS = ('fifo', 'average')
+ACTIONS = ('BUY', 'SELL')
+# Dialects whose INSERT supports ON CONFLICT DO NOTHING
+UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def cost_method():
+    """LEDGER_COST_METHOD: 'fifo' (default) or 'average'; run rebuild_ledger.py after changing it"""
+    method = os.getenv('LEDGER_COST_METHOD', 'fifo').lower()
+    if method not in COST_METHODS:
+        raise ValueError(f"Unknown cost method: {method}")
+    return method
+
+def apply_trade(position, action, quantity, price, method='fifo'):
+    """
+    Apply one BUY/SELL to a position's open lots. Trades against the position's
+    direction close lots oldest first and realize P&L; the rest opens a new lot
+    (merged into the single average-cost lot under 'average'). Shorts are lots
+    with negative quantity.
+    """
+    action = str(action).upper()
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    lots = json.loads(position.lots or '[]')
+    quantity, price = int(quantity), float(price)
+    remaining = quantity if action == 'BUY' else -quantity
+    realized = 0.0
+    while remaining and lots and (lots[0][0] > 0) != (remaining > 0):
+        lot_quantity, lot_price = lots[0]
+        direction = 1 if lot_quantity > 0 else -1
+        closed = min(abs(remaining), abs(lot_quantity))
+        realized += closed * (price - lot_price) * direction
+        lot_quantity -= closed * direction
+        remaining += closed * direction
+        if lot_quantity:
+            lots[0][0] = lot_quantity
+        else:
+            lots.pop(0)
+    if remaining:
+        if method == 'average' and lots:
+            held, avg = lots[0]
+            lots[0] = [held + remaining, (held * avg + remaining * price) / (held + remaining)]
+        else:
+            lots.append([remaining, price])
+
+    position.lots = json.dumps(lots)
+    position.quantity = sum(lot[0] for lot in lots)
+    position.cost_basis = sum(lot[0] * lot[1] for lot in lots)
+    position.realized_pnl = (position.realized_pnl or 0.0) + realized
+    return realized
+
+def _lock_positions(user_id, symbols):
+    """
+    Load a user's positions in symbols for update. Missing rows are first inserted
+    empty (ON CONFLICT DO NOTHING), so concurrent first trades in a symbol do not
+    race on the unique constraint, and on SQLite the transaction holds the write lock
+    before it reads, so concurrent trades cannot lose each other's updates.
+    """
+    insert = UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert is not None:
+        db.session.execute(
+            insert(Position).values([
+                {'user_id': user_id, 'stock_symbol': symbol, 'quantity': 0, 'cost_basis': 0.0,
+                 'realized_pnl': 0.0, 'lots': '[]'}
+                for symbol in symbols
+            ]).on_conflict_do_nothing(index_elements=['user_id', 'stock_symbol'])
+        )
+    query = Position.query.filter(Position.user_id == user_id, Position.stock_symbol.in_(symbols))
+    return {p.stock_symbol: p for p in query.with_for_update().populate_existing()}
+
+def apply_transactions(user_id, transactions, method=None):
+    """
+    Update a user's positions in the current session for transaction mappings
+    (stock_symbol, action, quantity, price, timestamp), in timestamp order as
+    rebuild_ledger applies them. A symbol that receives a transaction older than
+    its latest recorded one is replayed from its full history, so backdated rows
+    give the same lots and realized P&L as a rebuild. Locks each touched position
+    once. Call before the transactions are added to the session; the caller commits.
+    """
+    method = method or cost_method()
+    trades = {}
+    for t in sorted(transactions, key=lambda t: t['timestamp']):
+        trades.setdefault(t['stock_symbol'], []).append(t)
+    if not trades:
+        return {}
+    positions = _lock_positions(user_id, list(trades))
+    latest = dict(
+        db.session.query(Transaction.stock_symbol, func.max(Transaction.timestamp))
+        .filter(Transaction.user_id == user_id, Transaction.stock_symbol.in_(list(trades)))
+        .group_by(Transaction.stock_symbol)
+    )
+    for symbol, symbol_trades in trades.items():
+        position = positions.get(symbol)
+        if position is None:
+            position = positions[symbol] = Position(
+                user_id=user_id, stock_symbol=symbol, quantity=0, cost_basis=0.0, realized_pnl=0.0, lots='[]'
+            )
+            db.session.add(position)
+        if latest.get(symbol) is not None and symbol_trades[0]['timestamp'] < latest[symbol]:
+            history = (db.session.query(Transaction.action, Transaction.quantity, Transaction.price, Transaction.timestamp)
+                       .filter(Transaction.user_id == user_id, Transaction.stock_symbol == symbol)
+                       .order_by(Transaction.timestamp, Transaction.id))
+            # Stable sort: recorded rows stay ahead of new ones with the same timestamp, as their ids are lower
+            symbol_trades = sorted([row._asdict() for row in history] + symbol_trades, key=lambda t: t['timestamp'])
+            position.lots, position.quantity, position.cost_basis, position.realized_pnl = '[]', 0, 0.0, 0.0
+        for t in symbol_trades:
+            apply_trade(position, t['action'], t['quantity'], t['price'], method)
+    return positions
+
+def rebuild_ledger(user_ids=None, method=None, batch_size=10000):
+    """Recompute positions from each user's full transaction history; returns the number of positions written"""
+    method = method or cost_method()
+    if user_ids is None:
+        user_ids = [row[0] for row in db.session.query(Transaction.user_id).distinct()]
+    written = 0
+    for user_id in user_ids:
+        Position.query.filter_by(user_id=user_id).delete()
+        positions = {}
+        rows = (db.session.query(Transaction.stock_symbol, Transaction.action, Transaction.quantity, Transaction.price)
+                .filter(Transaction.user_id == user_id)
+                .order_by(Transaction.timestamp, Transaction.id)
+                .yield_per(batch_size))
+        for symbol, action, quantity, price in rows:
+            position = positions.get(symbol)
+            if position is None:
+                position = positions[symbol] = Position(
+                    user_id=user_id, stock_symbol=symbol, quantity=0, cost_basis=0.0, realized_pnl=0.0, lots='[]'
+                )
+            apply_trade(position, action, quantity, price, method)
+        db.session.add_all(positions.values())
+        db.session.commit()
+        written += len(positions)
+    return written
+
+def value_positions(user_id):
+    """A user's positions valued at the latest prices: O(positions), independent of transaction history"""
+    positions = Position.query.filter_by(user_id=user_id).order_by(Position.stock_symbol).all()
+    prices = latest_prices([p.stock_symbol for p in positions])
+    result = []
+    for position, price in zip(positions, prices):
+        row = position.to_dict()
+        row['price'] = None if np.isnan(price) else float(price)
+        row['market_value'] = position.quantity * row['price'] if row['price'] is not None else None
+        row['unrealized_pnl'] = row['market_value'] - position.cost_basis if row['price'] is not None else None
+        result.append(row)
+    return result
@@ -0,0 +1,266 @@
+import asyncio
+import functools
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cerebras_client import cache_key, generate_recommendation, stream_recommendation
+
+PRIORITIES = {'interactive': 0, 'batch': 1}
+MAX_BATCHES_PER_OWNER = 100
+MAX_BATCH_PROMPTS = 500
+MAX_OUTSTANDING_PER_OWNER = 1000  # queued or running batch prompts
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+class BatchLimitExceeded(Exception):
+    """The owner already has MAX_OUTSTANDING_PER_OWNER batch prompts outstanding"""
+
+class _Job:
+    def __init__(self, key, prompt, options, priority, future, generate):
+        self.key = key
+        self.prompt = prompt
+        self.options = options
+        self.priority = priority
+        self.future = future
+        self.generate = generate
+        self.enqueued = time.perf_counter()
+        self.started = False
+        self.waiters = 1
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+
+class LLMDispatcher:
+    """
+    Runs LLM generations on an asyncio loop in a background thread, with at most
+    `concurrency` requests in flight toward the Ollama host.
+
+    Jobs wait in a priority queue where interactive work always goes ahead of batch
+    work. Identical in-flight prompts (same model, prompt, max_tokens, temperature
+    and use_cache) are coalesced into one generation; an interactive duplicate of a
+    queued batch job promotes it. A queued job whose callers have all cancelled is
+    dropped. Streams (stream_text) take a slot like any other job and hold it until
+    they end.
+
+    generate / stream must raise on failure so errors are counted and reported.
+    """
+    def __init__(self, concurrency=None, generate=functools.partial(generate_recommendation, raise_errors=True),
+                 stream=stream_recommendation):
+        self.concurrency = concurrency or int(os.getenv('OLLAMA_CONCURRENCY', 4))
+        self.generate = generate
+        self.stream = stream
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='llm')
+        self.loop = asyncio.new_event_loop()
+        self.inflight = {}
+        self.batches = {}
+        self._owner_batches = {}  # owner -> OrderedDict of their batch ids, oldest first
+        self._sequence = itertools.count()
+        self._counts = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        self._queue_wait = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self._inference = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self._stats_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='llm-dispatcher', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [self.loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    async def submit(self, prompt, priority='interactive', max_tokens=150, temperature=0.7, use_cache=None):
+        """Generated text for prompt; must be awaited on the dispatcher's loop"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self._counts['submitted'] += 1
+        key = (cache_key(prompt, max_tokens, temperature), use_cache)
+        job = self.inflight.get(key)
+        if job is not None:
+            self._counts['coalesced'] += 1
+            job.waiters += 1
+            if not job.started and PRIORITIES[priority] < PRIORITIES[job.priority]:
+                # Re-queue at the higher priority; the worker skips the stale entry
+                job.priority = priority
+                self.queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        else:
+            options = {'max_tokens': max_tokens, 'temperature': temperature, 'use_cache': use_cache}
+            job = self.inflight[key] = _Job(key, prompt, options, priority, self.loop.create_future(), self.generate)
+            self.queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self._release(job)
+            raise
+
+    def _release(self, job):
+        # A caller gave up waiting; drop the job if it is still queued and nobody else wants it
+        job.waiters -= 1
+        if job.waiters == 0 and not job.started:
+            job.started = True  # the worker skips it
+            if self.inflight.get(job.key) is job:
+                del self.inflight[job.key]
+            job.future.cancel()
+            self._counts['cancelled'] += 1
+
+    async def _submit_uncoalesced(self, prompt, priority, generate, options):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self._counts['submitted'] += 1
+        job = _Job(None, prompt, options, priority, self.loop.create_future(), generate)
+        self.queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        return await asyncio.shield(job.future)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self.queue.get()
+            if job.started:
+                continue
+            job.started = True
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._queue_wait[job.priority].append(started - job.enqueued)
+            try:
+                result = await self.loop.run_in_executor(
+                    self.executor, lambda: job.generate(job.prompt, **job.options)
+                )
+                job.future.set_result(result)
+                self._counts['completed'] += 1
+            except Exception as e:
+                job.future.set_exception(e)
+                self._counts['failed'] += 1
+            finally:
+                with self._stats_lock:
+                    self._inference[job.priority].append(time.perf_counter() - started)
+                if job.key is not None:
+                    self.inflight.pop(job.key, None)
+
+    def submit_threadsafe(self, prompt, priority='interactive', **options):
+        """concurrent.futures.Future of the generated text, for callers outside the loop (e.g. Flask views)"""
+        return asyncio.run_coroutine_threadsafe(self.submit(prompt, priority, **options), self.loop)
+
+    def generate_text(self, prompt, priority='interactive', **options):
+        """Blocking generation through the dispatcher's queue and concurrency limit"""
+        return self.submit_threadsafe(prompt, priority, **options).result()
+
+    def stream_text(self, prompt, priority='interactive', **options):
+        """
+        Generator of text fragments from self.stream, queued and concurrency-limited
+        like generate_text(): the generation runs on a worker, holding its slot until
+        the stream ends or the caller stops iterating. Errors are raised to the caller.
+        """
+        fragments = queue.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def produce(prompt, **options):
+            if stopped.is_set():
+                return
+            stream = self.stream(prompt, **options)
+            try:
+                for fragment in stream:
+                    if stopped.is_set():
+                        break
+                    fragments.put(fragment)
+            finally:
+                stream.close()
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._submit_uncoalesced(prompt, priority, produce, options), self.loop
+        )
+        future.add_done_callback(lambda _: fragments.put(done))
+        try:
+            while True:
+                fragment = fragments.get()
+                if fragment is done:
+                    break
+                yield fragment
+            future.result()
+        finally:
+            stopped.set()
+
+    def submit_batch(self, prompts, priority='batch', owner=None, **options):
+        """
+        Queue every prompt and return a batch id for batch_status(). A batch holds at
+        most MAX_BATCH_PROMPTS prompts (ValueError) and an owner at most
+        MAX_OUTSTANDING_PER_OWNER unfinished prompts across their batches
+        (BatchLimitExceeded). Each owner keeps their MAX_BATCHES_PER_OWNER most recent
+        batches; an older batch's unfinished prompts are cancelled when it is dropped.
+        """
+        if len(prompts) > MAX_BATCH_PROMPTS:
+            raise ValueError(f"A batch holds at most {MAX_BATCH_PROMPTS} prompts")
+        batch_id = uuid.uuid4().hex
+        with _dispatcher_lock:
+            owned = self._owner_batches.setdefault(owner, OrderedDict())
+            outstanding = sum(not f.done() for b in owned for f in self.batches[b]['futures'])
+            if outstanding + len(prompts) > MAX_OUTSTANDING_PER_OWNER:
+                raise BatchLimitExceeded(
+                    f"{outstanding} prompts still outstanding; at most {MAX_OUTSTANDING_PER_OWNER} allowed"
+                )
+            futures = [self.submit_threadsafe(prompt, priority, **options) for prompt in prompts]
+            self.batches[batch_id] = {'owner': owner, 'futures': futures, 'submitted': time.time()}
+            owned[batch_id] = None
+            while len(owned) > MAX_BATCHES_PER_OWNER:
+                for future in self.batches.pop(owned.popitem(last=False)[0])['futures']:
+                    future.cancel()
+        return batch_id
+
+    def batch_status(self, batch_id):
+        """
+        Progress of a batch; once every prompt is done, results in prompt order (None
+        where generation failed) and the failures' errors. None if the batch is unknown.
+        """
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        futures = batch['futures']
+        completed = sum(f.done() for f in futures)
+        status = {'batch_id': batch_id, 'owner': batch['owner'], 'total': len(futures), 'completed': completed,
+                  'done': completed == len(futures)}
+        if status['done']:
+            errors = [(i, f.exception()) for i, f in enumerate(futures) if f.exception()]
+            status['failed'] = len(errors)
+            status['results'] = [None if f.exception() else f.result() for f in futures]
+            status['errors'] = [{'index': i, 'error': str(e)} for i, e in errors]
+        return status
+
+    def run_batch(self, prompts, priority='batch', **options):
+        """Generate every prompt concurrently and return the results in order (blocking)"""
+        futures = [self.submit_threadsafe(prompt, priority, **options) for prompt in prompts]
+        return [f.result() for f in futures]
+
+    def metrics(self):
+        """Counts, queue depth and queue-wait / inference latency (seconds) per priority"""
+        with self._stats_lock:
+            waits = {name: list(samples) for name, samples in self._queue_wait.items()}
+            inference = {name: list(samples) for name, samples in self._inference.items()}
+        result = dict(self._counts)
+        result['queued'] = self.queue.qsize()
+        result['inflight'] = len(self.inflight)
+        result['concurrency'] = self.concurrency
+        for name in PRIORITIES:
+            result[name] = {
+                'queue_wait_p50': _percentile(waits[name], 0.5),
+                'queue_wait_p95': _percentile(waits[name], 0.95),
+                'inference_p50': _percentile(inference[name], 0.5),
+                'inference_p95': _percentile(inference[name], 0.95)
+            }
+        return result
+
+def get_dispatcher():
+    """The process-wide LLMDispatcher, started on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = LLMDispatcher()
+        return _dispatcher
@@ -13,6 +13,7 @@ class User(db.Model):
     transactions = db.relationship('Transaction', backref='user', lazy=True)
     recommendations = db.relationship('Recommendation', backref='user', lazy=True)
     risk_analyses = db.relationship('RiskAnalysis', backref='user', lazy=True)
+    positions = db.relationship('Position', backref='user', lazy=True)
 
     def to_dict(self):
         return {
@@ -23,6 +24,7 @@ class User(db.Model):
 
 class Portfolio(db.Model):
     __tablename__ = 'portfolios'
+    __table_args__ = (db.Index('ix_portfolios_user_id_timestamp', 'user_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     stock_symbol = db.Column(db.String(10), nullable=False)
@@ -42,6 +44,7 @@ class Portfolio(db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (db.Index('ix_transactions_user_id_timestamp', 'user_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     stock_symbol = db.Column(db.String(10), nullable=False)
@@ -61,8 +64,34 @@ class Transaction(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
 
+class Position(db.Model):
+    """Ledger of a user's holding in one symbol, maintained from their transactions"""
+    __tablename__ = 'positions'
+    __table_args__ = (db.UniqueConstraint('user_id', 'stock_symbol', name='uq_positions_user_id_stock_symbol'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    stock_symbol = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    cost_basis = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    lots = db.Column(db.Text, nullable=False, default='[]')  # JSON [[quantity, price], ...], oldest first
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'stock_symbol': self.stock_symbol,
+            'quantity': self.quantity,
+            'cost_basis': self.cost_basis,
+            'avg_cost': self.cost_basis / self.quantity if self.quantity else None,
+            'realized_pnl': self.realized_pnl,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+
 class MarketData(db.Model):
     __tablename__ = 'market_data'
+    __table_args__ = (db.Index('ix_market_data_symbol_timestamp', 'symbol', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     symbol = db.Column(db.String(10), nullable=False)
     price = db.Column(db.Float, nullable=False)
@@ -78,6 +107,7 @@ class MarketData(db.Model):
 
 class Recommendation(db.Model):
     __tablename__ = 'recommendations'
+    __table_args__ = (db.Index('ix_recommendations_user_id_timestamp', 'user_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     text = db.Column(db.String(500), nullable=False)
@@ -93,6 +123,7 @@ class Recommendation(db.Model):
 
 class RiskAnalysis(db.Model):
     __tablename__ = 'risk_analyses'
+    __table_args__ = (db.Index('ix_risk_analyses_user_id_timestamp', 'user_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     risk_score = db.Column(db.Float, nullable=False)
@@ -0,0 +1,89 @@
+import base64
+import datetime
+import json
+
+from flask import jsonify
+from sqlalchemy import or_
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+def encode_cursor(timestamp, last_id):
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, last_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp or None for a row without one, id) of the last row of the previous page"""
+    try:
+        timestamp, last_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (datetime.datetime.fromisoformat(timestamp) if timestamp is not None else None), int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+def paginate(model, user_id, args):
+    """
+    One page of a user's rows of model, newest first, using keyset pagination on
+    (timestamp, id) so every page is an index range scan on (user_id, timestamp).
+    Rows without a timestamp are paged after the dated ones run out, by id alone.
+
+    args: limit, cursor (from the previous page), fields (comma-separated columns)
+    and start/end (ISO 8601 timestamps, end exclusive).
+    Returns (rows as dicts, next cursor or None); raises ValueError for bad args.
+    """
+    columns = model.__table__.columns
+    fields = [f for f in args.get('fields', '').split(',') if f] or list(columns.keys())
+    unknown = [f for f in fields if f not in columns]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        start = datetime.datetime.fromisoformat(args['start']) if 'start' in args else None
+        end = datetime.datetime.fromisoformat(args['end']) if 'end' in args else None
+    except ValueError:
+        raise ValueError("limit must be an integer and start/end ISO 8601 timestamps")
+
+    # id and timestamp are always loaded to build the next cursor
+    loaded = list(dict.fromkeys(fields + ['id', 'timestamp']))
+    query = model.query.with_entities(*(columns[f] for f in loaded)).filter(model.user_id == user_id)
+    if start is not None:
+        query = query.filter(model.timestamp >= start)
+    if end is not None:
+        query = query.filter(model.timestamp < end)
+    cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+
+    # Dated rows first, newest first; every page is a range seek below the cursor
+    rows = []
+    if cursor is None or cursor[0] is not None:
+        if cursor is None:
+            dated = query.filter(model.timestamp.isnot(None))
+        else:
+            timestamp, last_id = cursor
+            dated = query.filter(model.timestamp <= timestamp,
+                                 or_(model.timestamp < timestamp, model.id < last_id))
+        rows = dated.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).all()
+    # Then rows without a timestamp (never inside a start/end range), by id alone
+    if len(rows) <= limit and start is None and end is None:
+        undated = query.filter(model.timestamp.is_(None))
+        if cursor is not None and cursor[0] is None:
+            undated = undated.filter(model.id < cursor[1])
+        rows += undated.order_by(model.id.desc()).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [{f: _serialize(getattr(row, f)) for f in fields} for row in rows], next_cursor
+
+def paginated_response(model, user_id, args):
+    """(response, status) for a list endpoint: a JSON list with the next page's cursor in X-Next-Cursor"""
+    try:
+        items, next_cursor = paginate(model, user_id, args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
@@ -0,0 +1,15 @@
+"""
+Recompute the positions ledger from transaction history.
+
+    python rebuild_ledger.py            # every user
+    python rebuild_ledger.py 12 42      # selected user ids
+"""
+import sys
+
+from app import app
+from ledger import cost_method, rebuild_ledger
+
+with app.app_context():
+    user_ids = [int(arg) for arg in sys.argv[1:]] or None
+    written = rebuild_ledger(user_ids)
+    print(f"Ledger rebuilt ({cost_method()}): {written} positions")
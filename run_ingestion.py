@@ -0,0 +1,48 @@
+"""
+Run the ingestion scheduler until interrupted, printing its metrics periodically.
+
+    python run_ingestion.py AAPL MSFT GOOG        # symbols on the command line
+    INGEST_SYMBOLS=AAPL,MSFT python run_ingestion.py
+
+INGEST_QUOTE_INTERVAL / INGEST_NEWS_INTERVAL set the polling intervals (seconds),
+INGEST_NEWS_TOPICS a comma-separated topic list (no news polling if unset) and
+INGEST_METRICS_INTERVAL how often metrics are printed.
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+from agents.data_ingestion_agent import DataIngestionAgent
+from agents.ingestion_scheduler import IngestionScheduler
+
+def env_list(name):
+    return [item.strip() for item in os.getenv(name, '').split(',') if item.strip()]
+
+symbols = sys.argv[1:] or env_list('INGEST_SYMBOLS')
+news_topics = env_list('INGEST_NEWS_TOPICS')
+if not symbols and not news_topics:
+    sys.exit("No symbols or news topics to poll: pass symbols or set INGEST_SYMBOLS / INGEST_NEWS_TOPICS")
+metrics_interval = float(os.getenv('INGEST_METRICS_INTERVAL', 60))
+
+scheduler = IngestionScheduler(
+    DataIngestionAgent(),
+    [symbol.upper() for symbol in symbols],
+    quote_interval=float(os.getenv('INGEST_QUOTE_INTERVAL', 5)),
+    news_topics=news_topics or None,
+    news_interval=float(os.getenv('INGEST_NEWS_INTERVAL', 300))
+)
+scheduler.start()
+print(f"Polling {len(symbols)} symbols" + (f" and news for {', '.join(news_topics)}" if news_topics else ''))
+try:
+    while True:
+        time.sleep(metrics_interval)
+        m = scheduler.metrics()
+        print(f"{datetime.now():%H:%M:%S} polls={m['polls']} not_modified={m['not_modified']} "
+              f"errors={m['errors']} ticks={m['ticks_written']} articles={m['articles_written']} "
+              f"queue={m['queue_depth']}/{m['queue_capacity']} max_staleness={m['max_staleness']:.1f}s "
+              f"never_succeeded={m['never_succeeded']}")
+except KeyboardInterrupt:
+    pass
+finally:
+    scheduler.stop()
@@ -0,0 +1,42 @@
+from agents.news_dedup import NearDuplicateIndex, simhash, word_set
+
+TITLE = "Apple beats quarterly revenue estimates on strong iPhone demand"
+SUMMARY = ("Apple reported quarterly revenue above analyst estimates on Thursday, helped by strong "
+           "demand for its latest iPhone models in China and the United States.")
+
+def index_with(title, summary):
+    index = NearDuplicateIndex()
+    text = f'{title} {summary}'
+    index.add(simhash(text), 'original', word_set(text))
+    return index
+
+def find(index, title, summary):
+    text = f'{title} {summary}'
+    return index.find(simhash(text), word_set(text))
+
+def test_one_word_edit_of_short_wire_item_is_a_near_duplicate():
+    index = index_with(TITLE, SUMMARY)
+    copy_title = TITLE.replace('estimates', 'forecasts')
+    # Too far apart for SimHash alone
+    assert bin(simhash(f'{TITLE} {SUMMARY}') ^ simhash(f'{copy_title} {SUMMARY}')).count('1') > index.max_distance
+    assert find(index, copy_title, SUMMARY) == 'original'
+    assert find(index, TITLE, SUMMARY.replace('Thursday', 'Wednesday')) == 'original'
+
+def test_different_story_sharing_words_is_not_a_duplicate():
+    index = index_with(TITLE, SUMMARY)
+    other_title = "Apple misses quarterly revenue estimates on weak Mac demand"
+    other_summary = ("Apple reported quarterly revenue below analyst estimates on Thursday, as demand for "
+                     "Mac computers slowed sharply across Europe and Japan.")
+    assert find(index, other_title, other_summary) is None
+
+def test_long_articles_still_match_by_simhash():
+    body = ' '.join(f'word{i}' for i in range(300))
+    index = index_with(TITLE, body)
+    assert find(index, TITLE, body + ' extra') == 'original'
+
+def test_evicted_short_articles_leave_no_postings():
+    index = NearDuplicateIndex(capacity=1)
+    for key, text in (('a', f'{TITLE} {SUMMARY}'), ('b', 'Unrelated headline about oil prices')):
+        index.add(simhash(text), key, word_set(text))
+    assert set(index.word_sets) == {'b'}
+    assert all(keys == {'b'} for keys in index.postings.values())
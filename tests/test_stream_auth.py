@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(_tmp, "app.db")}')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key-long-enough-for-hs256')
+os.environ.setdefault('TICK_STORE_PATH', os.path.join(_tmp, 'ticks'))
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # The stream watches the agent databases, which live in the working directory
+    monkeypatch.chdir(tmp_path)
+    with app.app_context():
+        db.create_all()
+        token = create_access_token(identity='1')
+    return app.test_client(), token
+
+def first_chunk(response):
+    chunk = next(iter(response.response))
+    response.close()
+    return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+def test_stream_accepts_token_in_query_string_for_event_source(client):
+    client, token = client
+    response = client.get(f'/stream?topics=quote&jwt={token}', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert first_chunk(response).startswith('retry:')
+
+def test_stream_still_accepts_authorization_header(client):
+    client, token = client
+    response = client.get('/stream?topics=quote', headers={'Authorization': f'Bearer {token}'}, buffered=False)
+    assert response.status_code == 200
+    first_chunk(response)
+
+def test_stream_rejects_missing_token(client):
+    client, _ = client
+    assert client.get('/stream?topics=quote').status_code == 401
+
+def test_query_string_token_is_only_accepted_by_stream(client):
+    client, token = client
+    assert client.get(f'/positions?jwt={token}').status_code == 401
@@ -0,0 +1,135 @@
+import codecs
+import csv
+import datetime
+import io
+import json
+import math
+import time
+
+from database import db
+from ledger import apply_transactions
+from models import Transaction
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+ACTIONS = ('BUY', 'SELL')
+
+def _csv_records(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for record in reader:
+        yield reader.line_num, record
+
+def _ndjson_records(stream):
+    # Decode incrementally so a multi-byte character split across reads is kept intact
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    line_num = 0
+    while True:
+        chunk = stream.read(64 * 1024)
+        buffer += decoder.decode(chunk, final=not chunk)
+        *lines, buffer = buffer.split('\n')
+        if not chunk:
+            lines.append(buffer)
+        for line in lines:
+            line_num += 1
+            if line.strip():
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError as e:
+                    yield line_num, e
+        if not chunk:
+            return
+
+def parse_records(stream, format):
+    """Yield (line number, record dict or parse error) from a CSV or NDJSON byte stream without reading it whole"""
+    if format == 'csv':
+        return _csv_records(stream)
+    if format == 'ndjson':
+        return _ndjson_records(stream)
+    raise ValueError(f"Unsupported import format: {format}")
+
+def validate(record, user_id):
+    """Transaction mapping for a record; raises ValueError describing the first problem"""
+    if isinstance(record, Exception):
+        raise ValueError(f"invalid JSON: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    symbol = str(record.get('stock_symbol') or '').strip().upper()
+    if not symbol or len(symbol) > 10:
+        raise ValueError("stock_symbol is required (max 10 characters)")
+    action = str(record.get('action') or '').strip().upper()
+    if action not in ACTIONS:
+        raise ValueError("action must be BUY or SELL")
+    try:
+        quantity = float(record.get('quantity'))
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError("quantity must be an integer and price a number")
+    # float() accepts 'nan' and 'inf', which would otherwise slip past the sign check
+    if not (math.isfinite(quantity) and math.isfinite(price)):
+        raise ValueError("quantity and price must be finite")
+    if not quantity.is_integer():
+        raise ValueError("quantity must be a whole number")
+    quantity = int(quantity)
+    if quantity <= 0 or price <= 0:
+        raise ValueError("quantity and price must be positive")
+    mapping = {'user_id': user_id, 'stock_symbol': symbol, 'action': action, 'quantity': quantity, 'price': price}
+    if record.get('timestamp'):
+        timestamp = datetime.datetime.fromisoformat(str(record['timestamp']))
+        if timestamp.tzinfo is not None:
+            # Stored naive UTC, like the default below, so timestamps stay comparable
+            timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        mapping['timestamp'] = timestamp
+    else:
+        mapping['timestamp'] = datetime.datetime.utcnow()
+    return mapping
+
+def import_transactions(stream, format, user_id, chunk_size=CHUNK_SIZE):
+    """
+    Validate and insert a user's transactions from an upload stream, committing every
+    chunk_size valid rows. Returns counts, per-row errors and throughput. If the
+    upload stops being readable (not UTF-8, or not parseable as CSV), the rows read
+    so far are still committed and 'aborted' gives the line reading stopped at and the
+    error; every line before it has been imported or reported.
+    """
+    start = time.perf_counter()
+    imported = failed = 0
+    errors = []
+    chunk = []
+    last_line = 0
+    aborted = None
+
+    def flush():
+        apply_transactions(user_id, chunk)
+        db.session.bulk_insert_mappings(Transaction, chunk)
+        db.session.commit()
+        chunk.clear()
+
+    try:
+        for line_num, record in parse_records(stream, format):
+            last_line = line_num
+            try:
+                chunk.append(validate(record, user_id))
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': line_num, 'error': str(e)})
+                continue
+            imported += 1
+            if len(chunk) >= chunk_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        aborted = {'line': last_line + 1, 'error': str(e)}
+    if chunk:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+        'aborted': aborted,
+        'elapsed_seconds': elapsed,
+        'rows_per_second': (imported + failed) / elapsed if elapsed > 0 else 0
+    }
@@ -0,0 +1,86 @@
+import numpy as np
+from sqlalchemy import func, select
+
+from agents.quote_cache import latest_prices
+from database import db
+from models import MarketData, Portfolio
+
+def _market_data_prices(symbols):
+    """Latest MarketData price per symbol in one windowed IN query"""
+    ranked = select(
+        MarketData.symbol,
+        MarketData.price,
+        func.row_number().over(partition_by=MarketData.symbol, order_by=MarketData.timestamp.desc()).label('rn')
+    ).where(MarketData.symbol.in_(symbols)).subquery()
+    return dict(db.session.execute(select(ranked.c.symbol, ranked.c.price).where(ranked.c.rn == 1)).all())
+
+def get_prices(symbols, max_age=None):
+    """
+    Latest prices from the quote cache (quotes up to max_age seconds old, default the
+    cache ttl) / tick store, then MarketData for any still missing (NaN if none)
+    """
+    prices = latest_prices(symbols, max_age)
+    missing = [symbols[i] for i in np.flatnonzero(np.isnan(prices))]
+    if missing:
+        found = _market_data_prices(missing)
+        for i, symbol in enumerate(symbols):
+            if symbol in found:
+                prices[i] = found[symbol]
+    return prices
+
+def value_portfolio(user_id):
+    """
+    Market value, weights, unrealized P&L and concentration of a user's holdings,
+    computed in one vectorized pass over the symbols held
+    """
+    rows = db.session.query(Portfolio.stock_symbol, Portfolio.quantity, Portfolio.avg_buy_price) \
+        .filter(Portfolio.user_id == user_id).all()
+    symbols = sorted({symbol for symbol, _, _ in rows})
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    rows_symbol = np.array([index[symbol] for symbol, _, _ in rows], dtype=int)
+    quantity = np.bincount(rows_symbol, weights=[q for _, q, _ in rows], minlength=len(symbols))
+    cost = np.bincount(rows_symbol, weights=[q * p for _, q, p in rows], minlength=len(symbols))
+
+    price = get_prices(symbols)
+    priced = ~np.isnan(price)
+    market_value = np.where(priced, quantity * price, np.nan)
+    total_value = market_value[priced].sum()
+    total_cost = cost[priced].sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = market_value / total_value if total_value else np.full(len(symbols), np.nan)
+        unrealized = market_value - cost
+        # No percentage for a zero cost basis (e.g. shares received as a gift or transfer)
+        unrealized_pct = np.where(cost != 0, unrealized / cost * 100, np.nan)
+
+    weights = np.sort(weight[priced])[::-1]
+    hhi = float((weights ** 2).sum()) if len(weights) else None
+
+    def number(value):
+        return float(value) if np.isfinite(value) else None
+
+    return {
+        'total_value': float(total_value),
+        'total_cost': float(total_cost),
+        'unrealized_pnl': float(total_value - total_cost),
+        'unrealized_pnl_pct': float((total_value - total_cost) / total_cost * 100) if total_cost else None,
+        'concentration': {
+            'hhi': hhi,
+            'effective_positions': 1 / hhi if hhi else None,
+            'largest_weight': float(weights[0]) if len(weights) else None,
+            'top5_weight': float(weights[:5].sum()) if len(weights) else None
+        },
+        'unpriced_symbols': [symbols[i] for i in np.flatnonzero(~priced)],
+        'positions': [
+            {
+                'stock_symbol': symbol,
+                'quantity': float(quantity[i]),
+                'avg_buy_price': float(cost[i] / quantity[i]) if quantity[i] else None,
+                'price': number(price[i]),
+                'market_value': number(market_value[i]),
+                'weight': number(weight[i]),
+                'unrealized_pnl': number(unrealized[i]),
+                'unrealized_pnl_pct': number(unrealized_pct[i])
+            }
+            for i, symbol in enumerate(symbols)
+        ]
+    }